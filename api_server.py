@@ -0,0 +1,254 @@
+import os
+import json
+import asyncio
+from contextlib import asynccontextmanager
+
+import uvicorn
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+
+from lesson_store import get_lesson_store
+from retriever import warm_up
+from model_switcher import OutputFormat, OutputParseError, AGENTS, RACE, LLM_TIMEOUT
+from evaluation_pipeline import evaluate_response_with_rag_async, evaluate_response_with_rag_stream_async
+from telemetry import registry, inc
+
+load_dotenv()
+
+API_HOST = os.getenv("API_HOST", "0.0.0.0")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+API_WORKERS = int(os.getenv("API_WORKERS", "2"))
+# Evaluations running at once per worker, and how many more may wait for a
+# slot before new requests are turned away with 503.
+API_MAX_CONCURRENCY = int(os.getenv("API_MAX_CONCURRENCY", "16"))
+API_MAX_QUEUE = int(os.getenv("API_MAX_QUEUE", "64"))
+API_QUEUE_TIMEOUT = float(os.getenv("API_QUEUE_TIMEOUT", "30"))
+API_MAX_BATCH = int(os.getenv("API_MAX_BATCH", "50"))
+MODEL_CHOICES = [*AGENTS, RACE]
+
+
+class EvaluateRequest(BaseModel):
+    answer: str
+    lesson_id: str
+    model: str = "Gemini"
+
+
+class BatchRequest(BaseModel):
+    items: list[EvaluateRequest] = Field(min_length=1)
+
+
+class BatchItem(BaseModel):
+    lesson_id: str
+    result: OutputFormat | None = None
+    error: str | None = None
+
+
+class Overloaded(Exception):
+    pass
+
+
+class AdmissionControl:
+    # Bounded concurrency plus a bounded wait queue. Anything beyond that is
+    # rejected immediately rather than piling up behind a slow provider.
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_concurrency + max_queue
+        self.queue_timeout = queue_timeout
+        self.pending = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def reserve(self, count: int = 1):
+        if self.pending + count > self.max_pending:
+            inc("api_rejected_total", reason="queue_full")
+            raise Overloaded(f"{self.pending} evaluations pending, {count} more requested, limit {self.max_pending}")
+        self.pending += count
+
+    def release(self, count: int = 1):
+        self.pending -= count
+
+    @asynccontextmanager
+    async def slot(self):
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            inc("api_rejected_total", reason="queue_timeout")
+            raise Overloaded(f"no evaluation slot within {self.queue_timeout:.0f}s")
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    # Holds an admission reservation for as long as the response is being
+    # served. Releasing in the body generator's finally is not enough: a
+    # client that disconnects before the first chunk means the generator
+    # never starts, so its finally never runs.
+
+    def __init__(self, content, release, **kwargs):
+        super().__init__(content, **kwargs)
+        self._release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._release()
+
+
+admission = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global admission
+    admission = AdmissionControl(API_MAX_CONCURRENCY, API_MAX_QUEUE, API_QUEUE_TIMEOUT)
+    # Load the store and open the embeddings client once per worker, before
+    # the first request.
+    try:
+        await asyncio.to_thread(get_lesson_store)
+        await asyncio.to_thread(warm_up)
+    except Exception as e:
+        print(f"Retriever warm-up failed: {e}")
+    yield
+
+
+app = FastAPI(title="Arabic Lesson Recall Evaluation", lifespan=lifespan)
+
+
+def _lesson(lesson_id: str) -> dict:
+    lesson = get_lesson_store().get(lesson_id)
+    if lesson is None:
+        raise HTTPException(404, f"Unknown lesson: {lesson_id}")
+    return lesson
+
+
+def _check_model(model: str):
+    if model not in MODEL_CHOICES:
+        raise HTTPException(422, f"Unknown model {model!r}, expected one of {MODEL_CHOICES}")
+
+
+def _overloaded(e: Overloaded) -> HTTPException:
+    return HTTPException(503, f"Evaluation service is busy: {e}", headers={"Retry-After": "5"})
+
+
+async def _evaluate(request: EvaluateRequest, lesson: dict) -> dict:
+    async with admission.slot():
+        return await asyncio.wait_for(
+            evaluate_response_with_rag_async(request.answer, lesson, request.model, lesson_id=request.lesson_id),
+            # Retries and the parse repair happen inside; bound the whole thing.
+            LLM_TIMEOUT * 2,
+        )
+
+
+def _error_status(e: Exception) -> int:
+    if isinstance(e, OutputParseError):
+        return 502
+    if isinstance(e, asyncio.TimeoutError):
+        return 504
+    return 500
+
+
+@app.get("/healthz")
+async def healthz() -> dict:
+    return {"status": "ok", "pending": admission.pending, "max_pending": admission.max_pending}
+
+
+@app.get("/lessons")
+async def list_lessons() -> list[dict]:
+    return [{"id": lesson_id, "title": title} for lesson_id, title in get_lesson_store().index()]
+
+
+@app.get("/lessons/{lesson_id}")
+async def get_lesson(lesson_id: str) -> dict:
+    return {"id": lesson_id, **_lesson(lesson_id)}
+
+
+@app.post("/evaluate", response_model=OutputFormat)
+async def evaluate(request: EvaluateRequest) -> dict:
+    lesson = _lesson(request.lesson_id)
+    _check_model(request.model)
+    try:
+        admission.reserve()
+    except Overloaded as e:
+        raise _overloaded(e)
+    try:
+        result = await _evaluate(request, lesson)
+        inc("api_requests_total", route="/evaluate", status="200")
+        return result
+    except Overloaded as e:
+        raise _overloaded(e)
+    except Exception as e:
+        status = _error_status(e)
+        inc("api_requests_total", route="/evaluate", status=str(status))
+        raise HTTPException(status, f"{type(e).__name__}: {e}")
+    finally:
+        admission.release()
+
+
+@app.post("/evaluate/stream")
+async def evaluate_stream(request: EvaluateRequest) -> StreamingResponse:
+    # NDJSON: one {"result": ..., "done": false} line per partial, then the
+    # validated result with "done": true, or a final {"error": ...} line.
+    lesson = _lesson(request.lesson_id)
+    _check_model(request.model)
+    try:
+        admission.reserve()
+    except Overloaded as e:
+        raise _overloaded(e)
+
+    async def lines():
+        try:
+            async with admission.slot():
+                async for result, done in evaluate_response_with_rag_stream_async(
+                    request.answer, lesson, request.model, lesson_id=request.lesson_id
+                ):
+                    yield json.dumps({"result": result, "done": done}, ensure_ascii=False) + "\n"
+            inc("api_requests_total", route="/evaluate/stream", status="200")
+        except Exception as e:
+            inc("api_requests_total", route="/evaluate/stream", status=str(_error_status(e)))
+            yield json.dumps({"error": f"{type(e).__name__}: {e}"}, ensure_ascii=False) + "\n"
+
+    return AdmittedStreamingResponse(lines(), admission.release, media_type="application/x-ndjson")
+
+
+@app.post("/evaluate/batch", response_model=list[BatchItem])
+async def evaluate_batch(request: BatchRequest) -> list[dict]:
+    if len(request.items) > API_MAX_BATCH:
+        raise HTTPException(413, f"At most {API_MAX_BATCH} items per batch")
+    for item in request.items:
+        _lesson(item.lesson_id)
+        _check_model(item.model)
+    # All-or-nothing admission, so a batch never half-runs under overload.
+    try:
+        admission.reserve(len(request.items))
+    except Overloaded as e:
+        raise _overloaded(e)
+
+    async def one(item: EvaluateRequest) -> dict:
+        try:
+            return {"lesson_id": item.lesson_id, "result": await _evaluate(item, _lesson(item.lesson_id))}
+        except Exception as e:
+            return {"lesson_id": item.lesson_id, "error": f"{type(e).__name__}: {e}"}
+
+    try:
+        results = await asyncio.gather(*(one(item) for item in request.items))
+    finally:
+        admission.release(len(request.items))
+    inc("api_requests_total", route="/evaluate/batch", status="200")
+    return results
+
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    # Per worker process: scrape each worker, or run one worker per container.
+    return Response(registry.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+if __name__ == "__main__":
+    # Each worker is a separate process with its own store, agents and
+    # connection pool; the admission limits apply per worker.
+    uvicorn.run("api_server:app", host=API_HOST, port=API_PORT, workers=API_WORKERS)
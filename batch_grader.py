@@ -0,0 +1,189 @@
+import os
+import csv
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+from collections import defaultdict
+
+from rate_limit import AsyncRateLimiter
+from retriever import retrieve_chunks, RETRIEVAL_K
+from lesson_store import get_lessons, retrieval_chunks
+from model_switcher import token_usage
+from evaluation_pipeline import evaluate_response_with_rag_async
+
+REQUIRED_COLUMNS = ("student_id", "lesson_id", "answer")
+EXPORT_COLUMNS = ("row_key", "student_id", "lesson_id", "model", "score", "error", "result")
+
+
+def read_rows(path: str) -> list[dict]:
+    if path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(path, encoding="utf-8", newline="") as f:
+            rows = list(csv.DictReader(f))
+    for row in rows:
+        missing = [column for column in REQUIRED_COLUMNS if column not in row]
+        if missing:
+            raise ValueError(f"{path}: row is missing columns {missing}: {row}")
+    return rows
+
+
+def row_key(index: int, row: dict) -> str:
+    payload = f"{index}\x00{row['student_id']}\x00{row['lesson_id']}\x00{row['answer']}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:20]
+
+
+def load_checkpoint(output_path: str) -> set[str]:
+    # The output file doubles as the checkpoint: rows already graded without
+    # error are skipped when a run is resumed.
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Torn last line from a crashed run.
+                continue
+            if "error" not in record:
+                done.add(record["row_key"])
+    return done
+
+
+def lesson_context(lesson_id: str, lesson: dict, k: int = RETRIEVAL_K) -> str:
+    # One retrieval per lesson, shared by every answer in the group.
+    chunks = retrieval_chunks(lesson_id, lesson)
+    if chunks:
+        return "\n---\n".join(chunks[:k])
+    return retrieve_chunks("\n".join(lesson["key_points"]), k=k)
+
+
+def _usage_delta(before: dict, after: dict) -> dict:
+    delta = {}
+    for provider, totals in after.items():
+        previous = before.get(provider, {})
+        delta[provider] = {name: value - previous.get(name, 0) for name, value in totals.items()}
+    return delta
+
+
+async def grade_batch(rows: list[dict], output_path: str, model_choice: str = "Gemini",
+                      concurrency: int = 8, requests_per_minute: float = 60.0) -> dict:
+    done = load_checkpoint(output_path)
+    by_lesson = defaultdict(list)
+    for index, row in enumerate(rows):
+        key = row_key(index, row)
+        if key not in done:
+            by_lesson[row["lesson_id"]].append((key, row))
+
+    # Charged per LLM request actually sent (race mode sends two, retries and
+    # parse repairs add more), not per row.
+    limiter = AsyncRateLimiter(requests_per_minute, burst=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    usage_before = token_usage()
+    counts = {"graded": 0, "failed": 0, "skipped": len(done)}
+    started = time.perf_counter()
+
+    with open(output_path, "a", encoding="utf-8") as out:
+
+        def write(record: dict):
+            # Called from the event loop only, so lines never interleave.
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+        async def grade(key: str, row: dict, lesson: dict, retrieved_text: str):
+            record = {"row_key": key, "student_id": row["student_id"], "lesson_id": row["lesson_id"], "model": model_choice}
+            async with semaphore:
+                try:
+                    record["result"] = await evaluate_response_with_rag_async(
+                        row["answer"], lesson, model_choice, lesson_id=row["lesson_id"], retrieved_text=retrieved_text,
+                        rate_limiter=limiter,
+                    )
+                    counts["graded"] += 1
+                except Exception as e:
+                    record["error"] = f"{type(e).__name__}: {e}"
+                    counts["failed"] += 1
+            write(record)
+
+        tasks = []
+        lessons = get_lessons()
+        for lesson_id, items in by_lesson.items():
+            lesson = lessons.get(lesson_id)
+            if lesson is None:
+                for key, row in items:
+                    write({"row_key": key, "student_id": row["student_id"], "lesson_id": lesson_id,
+                           "model": model_choice, "error": f"Unknown lesson: {lesson_id}"})
+                    counts["failed"] += 1
+                continue
+            retrieved_text = await asyncio.to_thread(lesson_context, lesson_id, lesson)
+            tasks.extend(grade(key, row, lesson, retrieved_text) for key, row in items)
+        await asyncio.gather(*tasks)
+
+    elapsed = time.perf_counter() - started
+    processed = counts["graded"] + counts["failed"]
+    return {
+        **counts,
+        "elapsed_seconds": round(elapsed, 2),
+        "rows_per_second": round(processed / elapsed, 3) if elapsed else 0.0,
+        "token_usage": _usage_delta(usage_before, token_usage()),
+    }
+
+
+def export_parquet(output_path: str, parquet_path: str) -> str:
+    # Returns the path written: Parquet needs pandas plus pyarrow or
+    # fastparquet, otherwise the same table is written as CSV next to it.
+    records = {}
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            # Last attempt per row wins, so resumed retries replace failures.
+            if "error" not in record or record["row_key"] not in records:
+                records[record["row_key"]] = record
+    flat = []
+    for record in records.values():
+        result = record.get("result") or {}
+        flat.append({
+            "row_key": record["row_key"],
+            "student_id": record["student_id"],
+            "lesson_id": record["lesson_id"],
+            "model": record["model"],
+            "score": result.get("score"),
+            "error": record.get("error"),
+            "result": json.dumps(result, ensure_ascii=False) if result else None,
+        })
+    try:
+        import pandas as pd
+
+        pd.DataFrame(flat).to_parquet(parquet_path, index=False)
+        return parquet_path
+    except ImportError as e:
+        csv_path = os.path.splitext(parquet_path)[0] + ".csv"
+        print(f"Parquet export unavailable ({e}); writing {csv_path} instead")
+        with open(csv_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=EXPORT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(flat)
+        return csv_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Grade a CSV/JSONL of (student_id, lesson_id, answer) rows.")
+    parser.add_argument("input")
+    parser.add_argument("--out", default="batch_results.jsonl", help="JSONL results; also the resume checkpoint")
+    parser.add_argument("--parquet", default=None, help="also write the final results as Parquet")
+    parser.add_argument("--model", default="Gemini", choices=["Gemini", "OpenAI", "Race"])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=60.0, help="max LLM requests per minute (every request, including retries)")
+    args = parser.parse_args()
+
+    rows = read_rows(args.input)
+    summary = asyncio.run(grade_batch(rows, args.out, args.model, args.concurrency, args.rate))
+    if args.parquet:
+        print(f"Results exported to {export_parquet(args.out, args.parquet)}")
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,358 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import resource
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import Union
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from pydantic_ai import Agent
+from pydantic_ai.models.function import FunctionModel, AgentInfo
+from pydantic_ai.messages import ModelMessage, ModelResponse, TextPart, ToolCallPart, UserPromptPart
+
+import model_switcher
+import response_cache
+from model_switcher import OutputFormat
+from lesson_store import get_lessons
+from retriever import get_retriever, retrieve_chunks
+from prompt_templates import build_rag_prompt, count_tokens, PROMPT_VERSION
+from evaluation_logger import append_example, get_sink
+from vector_index import INDEX_NAME, current_store_dir
+
+INSTRUCTIONS = "You are an expert Arabic language tutor."
+STAGES = ("retrieve", "prompt", "llm", "log", "total")
+CASSETTE_PATH = "benchmark_cassette.json"
+
+# Recall answers per lesson: blank, partial, transliterated and complete.
+DEFAULT_CORPUS = {
+    "lesson1": [
+        "",
+        "Raf' is for the subject.",
+        "Arabic has three cases: raf', nasb and jarr. Raf' is for the subject, predicate and doer, nasb for the done-to, jarr after prepositions.",
+        "الرفع للفاعل والمبتدأ والخبر، النصب للمفعول به وبعد بعض الحروف، والجر بعد حروف الجر.",
+    ],
+    "lesson2": [
+        "Words ending in damma are raf'.",
+        "Singular words ending with ضمة are الرفع, with كسرة are الجر, with فتحة are النصب.",
+        "dammatan means nasb and kasra means raf",
+    ],
+    "lesson3": [
+        "Words are heavy by default and you remove the ن to make them light.",
+        "light words have tanween",
+        "Words are heavy unless there is a reason to be light. To make a word light remove the noon: مسلمون becomes مسلمو.",
+    ],
+    "lesson4": [
+        "Flexibility is part of status and only applies to singular words. Fully-flexible, partly-flexible and non-flexible.",
+        "There are two kinds of flexibility.",
+    ],
+    "lesson5": [
+        "Pronouns are first, second and third person. The forms are mustatir, munfasil and muttasil.",
+        "1st person has singular and plural; 2nd and 3rd have singular, dual and plural. الضمير المستتر، الضمير المنفصل، الضمير المتصل.",
+        "pronouns replace nouns",
+    ],
+}
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    # Recorded provider traffic: LLM outputs keyed by prompt hash and
+    # embedding vectors keyed by text hash.
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data = {"llm": {}, "embeddings": {}}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.data = json.load(f)
+
+    def save(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False)
+
+
+class ReplayEmbeddings(Embeddings):
+    # Recorded vectors when available, otherwise a deterministic
+    # pseudo-random unit vector per text. Never touches the network.
+
+    def __init__(self, cassette: Cassette, dim: int):
+        self.cassette = cassette
+        self.dim = dim
+        self.model = "replay"
+
+    def _vector(self, text: str) -> list[float]:
+        recorded = self.cassette.data["embeddings"].get(_hash(text))
+        if recorded is not None and len(recorded) == self.dim:
+            return recorded
+        rng = np.random.default_rng(int(_hash(text)[:16], 16))
+        vector = rng.standard_normal(self.dim).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._vector(text)
+
+
+class RecordingEmbeddings(Embeddings):
+
+    def __init__(self, backend, cassette: Cassette):
+        self.backend = backend
+        self.cassette = cassette
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors = self.backend.embed_documents(texts)
+        for text, vector in zip(texts, vectors):
+            self.cassette.data["embeddings"][_hash(text)] = list(vector)
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        vector = self.backend.embed_query(text)
+        self.cassette.data["embeddings"][_hash(text)] = list(vector)
+        return vector
+
+
+def _synthetic_output(prompt: str) -> dict:
+    return {
+        "score": 50 + int(_hash(prompt)[:2], 16) % 50,
+        "correct_points": ["You recalled part of the lesson."],
+        "incorrect_points": [],
+        "missed_points": ["Review the remaining key points."],
+        "generated_feedback": "Good start. Go over the lesson once more and try again.",
+        "rewritten_answer": "A complete answer covers every key point of the lesson.",
+    }
+
+
+def replay_model(cassette: Cassette, latency: float) -> FunctionModel:
+    async def respond(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        prompt = next(
+            part.content for message in reversed(messages) for part in getattr(message, "parts", [])
+            if isinstance(part, UserPromptPart)
+        )
+        output = cassette.data["llm"].get(_hash(prompt)) or _synthetic_output(prompt)
+        if latency:
+            await asyncio.sleep(latency)
+        if info.output_tools:
+            return ModelResponse(parts=[ToolCallPart(info.output_tools[0].name, output)])
+        return ModelResponse(parts=[TextPart(json.dumps(output, ensure_ascii=False))])
+
+    return FunctionModel(respond, model_name="replay")
+
+
+def install_replay(cassette: Cassette, latency: float):
+    # Swap the provider agents for replay agents with the same output types;
+    # model_switcher looks agents up per call, so nothing else changes.
+    model = replay_model(cassette, latency)
+    for provider in list(model_switcher.AGENTS):
+        model_switcher.AGENTS[provider] = Agent(model, instructions=INSTRUCTIONS, output_type=Union[OutputFormat, str])
+        model_switcher.TEXT_AGENTS[provider] = Agent(model, instructions=INSTRUCTIONS)
+
+
+def prepare_store(cassette: Cassette, record: bool):
+    service = get_retriever()
+    if record:
+        service._embeddings = RecordingEmbeddings(service._get_embeddings(), cassette)
+        service.get_store()
+        return
+    try:
+        import faiss
+
+        store_dir = current_store_dir(service.vector_path) or service.vector_path
+        dim = faiss.read_index(os.path.join(store_dir, INDEX_NAME)).d
+        service._embeddings = ReplayEmbeddings(cassette, dim)
+        service.get_store()
+    except Exception as e:
+        # No usable store on disk: index the lesson texts themselves.
+        from langchain_community.vectorstores import FAISS
+
+        print(f"Using a synthetic store built from the lesson texts ({e})")
+        embeddings = ReplayEmbeddings(cassette, 1536)
+        texts = [line.strip() for lesson in get_lessons().values() for line in lesson["content"].splitlines() if line.strip()]
+        service.set_store(FAISS.from_texts(texts, embeddings))
+
+
+def load_corpus(path: str | None) -> list[tuple[str, str]]:
+    if path is None:
+        return [(lesson_id, answer) for lesson_id, answers in DEFAULT_CORPUS.items() for answer in answers]
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return [(row["lesson_id"], row["answer"]) for row in rows]
+
+
+def run_one(lesson_id: str, answer: str, model_choice: str, log_path: str, cassette: Cassette, record: bool) -> dict:
+    timings = {}
+    lesson = get_lessons()[lesson_id]
+    started = time.perf_counter()
+
+    mark = time.perf_counter()
+    retrieved_text = retrieve_chunks(answer)
+    timings["retrieve"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    prompt = build_rag_prompt(answer, retrieved_text, lesson["key_points"])
+    timings["prompt"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    result = model_switcher.evaluate(prompt, model_choice)
+    timings["llm"] = time.perf_counter() - mark
+    if record:
+        cassette.data["llm"][_hash(prompt)] = result
+
+    mark = time.perf_counter()
+    append_example(prompt, result, path=log_path)
+    timings["log"] = time.perf_counter() - mark
+
+    timings["total"] = time.perf_counter() - started
+    return {
+        "timings": timings,
+        "prompt_tokens": count_tokens(prompt),
+        "output_tokens": count_tokens(json.dumps(result, ensure_ascii=False)),
+    }
+
+
+def percentiles(values: list[float]) -> dict:
+    ms = np.asarray(values) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+    }
+
+
+def run_level(corpus, concurrency: int, repeat: int, model_choice: str, log_path: str,
+              cassette: Cassette, record: bool) -> dict:
+    items = corpus * repeat
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        runs = list(pool.map(lambda item: run_one(*item, model_choice, log_path, cassette, record), items))
+    elapsed = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "requests": len(runs),
+        "throughput_rps": round(len(runs) / elapsed, 3),
+        "stages": {stage: percentiles([run["timings"][stage] for run in runs]) for stage in STAGES},
+        "tokens": {
+            "prompt_mean": round(float(np.mean([run["prompt_tokens"] for run in runs])), 1),
+            "output_mean": round(float(np.mean([run["output_tokens"] for run in runs])), 1),
+            "prompt_total": int(sum(run["prompt_tokens"] for run in runs)),
+        },
+    }
+
+
+def measure_memory(corpus, model_choice: str, log_path: str, cassette: Cassette) -> int:
+    # Separate sequential pass: tracemalloc hooks every allocation and would
+    # inflate the timed levels.
+    tracemalloc.start()
+    try:
+        for item in corpus:
+            run_one(*item, model_choice, log_path, cassette, record=False)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def compare(current: dict, baseline: dict) -> str:
+    lines = [f"vs {baseline.get('commit') or 'baseline'}:"]
+    previous = {level["concurrency"]: level for level in baseline["levels"]}
+    for level in current["levels"]:
+        old = previous.get(level["concurrency"])
+        if old is None:
+            continue
+        lines.append(f"  concurrency {level['concurrency']}: throughput "
+                     f"{old['throughput_rps']} -> {level['throughput_rps']} rps")
+        for stage in STAGES:
+            before, after = old["stages"][stage]["p95_ms"], level["stages"][stage]["p95_ms"]
+            change = (after - before) / before * 100 if before else 0.0
+            lines.append(f"    {stage:<8} p95 {before:>9.3f} -> {after:>9.3f} ms ({change:+.1f}%)")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline latency/throughput benchmark of the evaluation pipeline.")
+    parser.add_argument("--corpus", default=None, help="JSONL of {lesson_id, answer}; defaults to a built-in set")
+    parser.add_argument("--cassette", default=CASSETTE_PATH)
+    parser.add_argument("--record", action="store_true", help="call the real providers and record their responses")
+    parser.add_argument("--model", default="Gemini", choices=["Gemini", "OpenAI", "Race"])
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated worker counts")
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the corpus per concurrency level")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="simulated provider latency (seconds) in replay")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", default=None, help="previous results JSON to diff against")
+    parser.add_argument("--smoke", action="store_true",
+                        help="one quick replay pass at concurrency 1 and 2; exits non-zero if any stage fails")
+    args = parser.parse_args()
+    if args.smoke:
+        if args.record:
+            parser.error("--smoke runs in replay mode only")
+        args.concurrency, args.repeat = "1,2", 1
+
+    # Measure the pipeline itself, not cache hits.
+    response_cache.RESPONSE_CACHE_ENABLED = False
+    cassette = Cassette(args.cassette)
+    if not args.record:
+        install_replay(cassette, args.llm_latency)
+    prepare_store(cassette, args.record)
+
+    corpus = load_corpus(args.corpus)
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = os.path.join(tmp, "bench_log.jsonl")
+        # Warm-up pass so lazy loads don't land in the first level.
+        run_level(corpus[:1], 1, 1, args.model, log_path, cassette, args.record)
+        levels = []
+        for concurrency in [int(level) for level in args.concurrency.split(",")]:
+            level = run_level(corpus, concurrency, args.repeat, args.model, log_path, cassette, args.record)
+            levels.append(level)
+            print(f"concurrency {concurrency:>3}: {level['throughput_rps']:>8} rps, "
+                  f"total p95 {level['stages']['total']['p95_ms']} ms")
+        python_peak_bytes = None if args.record else measure_memory(corpus, args.model, log_path, cassette)
+        get_sink(log_path).flush()
+
+    if args.smoke:
+        print(f"Smoke run passed: {len(corpus)} answers through replay retrieval, prompt, LLM and log")
+        sys.exit(0)
+
+    if args.record:
+        cassette.save()
+        print(f"Recorded {len(cassette.data['llm'])} LLM responses to {args.cassette}")
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "mode": "record" if args.record else "replay",
+        "model": args.model,
+        "prompt_version": PROMPT_VERSION,
+        "corpus_size": len(corpus),
+        "python_peak_bytes": python_peak_bytes,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "levels": levels,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {args.out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print(compare(results, json.load(f)))
@@ -0,0 +1,181 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+
+from langchain_core.embeddings import Embeddings
+from dotenv import load_dotenv
+
+from telemetry import span, record_cache
+
+load_dotenv()
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(BASE_DIR, ".cache", "embeddings.sqlite"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+DEFAULT_LOCAL_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+
+def cache_key(model_name: str, kind: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\x00{kind}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class SQLiteEmbeddingCache:
+    # Vectors are stored as raw float32 blobs keyed by (model, text) hash and
+    # evicted least-recently-used once the table grows past max_entries.
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        found = {}
+        if not keys:
+            return found
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", part
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found]
+                )
+        return found
+
+    def put_many(self, model_name: str, items: list[tuple[str, list[float]]]):
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, model_name, array("f", vector).tobytes(), now) for key, vector in items]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._conn.execute("COMMIT")
+            self._count += len(rows)
+            if self._count > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        # Trim to 90% so eviction doesn't run on every insert once full.
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self._count - int(self.max_entries * 0.9)
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+            )
+            self._count -= excess
+
+    def __len__(self) -> int:
+        return self._count
+
+
+class LocalEmbeddings(Embeddings):
+    # CPU sentence-transformers model, for offline ingestion/retrieval and for
+    # measuring latency without the network. Indexes built with one backend
+    # must be queried with the same backend.
+
+    def __init__(self, model_name: str = DEFAULT_LOCAL_MODEL, batch_size: int = 32):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError(
+                "The local embedding backend needs sentence-transformers: pip install sentence-transformers"
+            ) from e
+        self.model = model_name
+        self.batch_size = batch_size
+        self._model = SentenceTransformer(model_name, device="cpu")
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors = self._model.encode(
+            texts, batch_size=self.batch_size, normalize_embeddings=True, convert_to_numpy=True
+        )
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+
+class CachedEmbeddings(Embeddings):
+
+    def __init__(self, backend: Embeddings, model_name: str | None = None, cache: SQLiteEmbeddingCache | None = None):
+        self.backend = backend
+        self.model_name = model_name or getattr(backend, "model", None) or getattr(backend, "model_name", None) or type(backend).__name__
+        self.cache = cache if cache is not None else SQLiteEmbeddingCache()
+        self.hits = 0
+        self.misses = 0
+
+    def _embed(self, texts: list[str], kind: str, compute) -> list[list[float]]:
+        keys = [cache_key(self.model_name, kind, text) for text in texts]
+        found = self.cache.get_many(list(set(keys)))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        hits = len(keys) - sum(1 for key in keys if key in missing)
+        self.hits += hits
+        self.misses += len(missing)
+        record_cache("embedding", "hit", hits)
+        record_cache("embedding", "miss", len(missing))
+        if missing:
+            with span("embedding", kind=kind):
+                vectors = compute(list(missing.values()))
+            computed = list(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model_name, computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._embed(texts, "doc", self.backend.embed_documents)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed([text], "query", lambda texts: [self.backend.embed_query(texts[0])])[0]
+
+    @property
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+_embeddings = {}
+_embeddings_lock = threading.Lock()
+
+
+def get_embeddings(backend: str | None = None) -> CachedEmbeddings:
+    # EMBEDDING_BACKEND=openai (default) or local; EMBEDDING_MODEL picks the model.
+    backend = (backend or os.getenv("EMBEDDING_BACKEND", "openai")).lower()
+    with _embeddings_lock:
+        if backend not in _embeddings:
+            model_name = os.getenv("EMBEDDING_MODEL")
+            if backend == "openai":
+                from langchain_openai import OpenAIEmbeddings
+
+                inner = OpenAIEmbeddings(model=model_name) if model_name else OpenAIEmbeddings()
+            elif backend == "local":
+                inner = LocalEmbeddings(model_name or DEFAULT_LOCAL_MODEL)
+            else:
+                raise ValueError(f"Unknown embedding backend: {backend}")
+            _embeddings[backend] = CachedEmbeddings(inner)
+        return _embeddings[backend]
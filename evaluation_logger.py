@@ -1,14 +1,210 @@
-import pandas as pd
 import os
+import re
+import csv
+import glob
 import json
+import time
+import queue
+import atexit
+import threading
 
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process ordering is guaranteed
+    fcntl = None
 
-def append_example(prompt: str, response: dict, path: str = "eval_dataset.csv"):
+from prompt_templates import PROMPT_VERSION
+from telemetry import span, inc
+
+EVAL_LOG_PATH = os.getenv("EVAL_LOG_PATH", "eval_dataset.jsonl")
+EVAL_CSV_PATH = "eval_dataset.csv"
+EVAL_LOG_MAX_BYTES = int(os.getenv("EVAL_LOG_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+_ROTATED_RE = re.compile(r"\.(\d{14})(?:-(\d+))?$")
+
+
+def _rotated_paths(path: str) -> list[str]:
+    # Oldest first. Names are stem.<timestamp>[-<n>]<ext>; a plain string sort
+    # would put stem.<ts>-1 before stem.<ts>, which was rotated earlier.
+    stem, ext = os.path.splitext(path)
+    rotated = []
+    for candidate in glob.glob(f"{glob.escape(stem)}.*{ext}"):
+        match = _ROTATED_RE.match(candidate[len(stem):len(candidate) - len(ext)])
+        if match:
+            rotated.append(((match.group(1), int(match.group(2) or 0)), candidate))
+    return [candidate for _, candidate in sorted(rotated)]
+
+
+class EvaluationLogSink:
+    # Request threads only enqueue; one background thread batches records and
+    # appends them to a JSONL file. Each batch is a single write under an
+    # exclusive file lock, so records from concurrent sessions (or processes)
+    # never interleave. Files past max_bytes are renamed aside, never rewritten.
+
+    def __init__(self, path: str = EVAL_LOG_PATH, max_queue: int = 10000, batch_size: int = 200,
+                 flush_interval: float = 1.0, max_bytes: int = EVAL_LOG_MAX_BYTES):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.dropped = 0
+        self.written = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="eval-log-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, record: dict, timeout: float = 0.1) -> bool:
+        if self._closed:
+            return False
+        try:
+            self._queue.put(record, timeout=timeout)
+            return True
+        except queue.Full:
+            # Never stall a student's request on logging.
+            self.dropped += 1
+            inc("eval_log_dropped_total")
+            return False
+
+    def _run(self):
+        while True:
+            try:
+                record = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = [record]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            records = [r for r in batch if r is not None]
+            try:
+                if records:
+                    with span("log.write"):
+                        self._write(records)
+                    inc("eval_log_records_total", len(records))
+            except Exception as e:
+                print(f"Evaluation log write failed ({len(records)} records): {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _write(self, records: list[dict]):
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf-8")
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        while True:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                # Another process may have rotated the file between our open
+                # and the lock; if so, reopen the new one.
+                try:
+                    current = os.stat(self.path)
+                except FileNotFoundError:
+                    continue
+                stat = os.fstat(fd)
+                if (stat.st_ino, stat.st_dev) != (current.st_ino, current.st_dev):
+                    continue
+                if stat.st_size and stat.st_size + len(data) > self.max_bytes:
+                    self._rotate()
+                    continue
+                os.write(fd, data)
+                self.written += len(records)
+                return
+            finally:
+                os.close(fd)
+
+    def _rotate(self):
+        stem, ext = os.path.splitext(self.path)
+        stamp = time.strftime("%Y%m%d%H%M%S")
+        target = f"{stem}.{stamp}{ext}"
+        suffix = 1
+        while os.path.exists(target):
+            target = f"{stem}.{stamp}-{suffix}{ext}"
+            suffix += 1
+        os.rename(self.path, target)
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        # Like Queue.join(), but gives up after timeout or if the writer
+        # thread has died, instead of blocking forever.
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._thread.is_alive():
+                    print(f"Evaluation log flush gave up with {self._queue.unfinished_tasks} records pending")
+                    return False
+                self._queue.all_tasks_done.wait(min(remaining, 0.5))
+        return True
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout=10)
+
+
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+
+def get_sink(path: str = EVAL_LOG_PATH) -> EvaluationLogSink:
+    with _sinks_lock:
+        if path not in _sinks:
+            _sinks[path] = EvaluationLogSink(path)
+        return _sinks[path]
+
+
+@atexit.register
+def _close_sinks():
+    for sink in list(_sinks.values()):
+        sink.close()
+
+
+def append_example(prompt: str, response: dict, path: str = EVAL_LOG_PATH):
 
     row = {
         "prompt": prompt,
-        "response": json.dumps(response, ensure_ascii=False),
+        "response": response,
+        "prompt_version": PROMPT_VERSION,
+        "logged_at": time.time(),
     }
-    pd.DataFrame([row]).to_csv(
-        path, mode="a", header=not os.path.exists(path), index=False
-    )
+    with span("log.append"):
+        get_sink(path).submit(row)
+
+
+def iter_examples(path: str = EVAL_LOG_PATH):
+    for file_path in [*_rotated_paths(path), path]:
+        if not os.path.exists(file_path):
+            continue
+        with open(file_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+def export_csv(path: str = EVAL_LOG_PATH, csv_path: str = EVAL_CSV_PATH) -> int:
+    # Writes the prompt/response columns gemini_eval.py reads.
+    count = 0
+    with open(csv_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["prompt", "response"])
+        for record in iter_examples(path):
+            writer.writerow([record["prompt"], json.dumps(record["response"], ensure_ascii=False)])
+            count += 1
+    return count
+
+
+if __name__ == "__main__":
+    count = export_csv()
+    print(f"Exported {count} examples from {EVAL_LOG_PATH} to {EVAL_CSV_PATH}")
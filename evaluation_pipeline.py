@@ -0,0 +1,141 @@
+import asyncio
+
+from prompt_templates import build_rag_prompt
+from evaluation_logger import append_example
+from model_switcher import evaluate, evaluate_async, evaluate_stream, evaluate_stream_async
+from retriever import retrieve_chunks, RETRIEVAL_K
+from lesson_chunks import rerank_chunks, lesson_hash
+from lesson_store import retrieval_chunks
+from response_cache import get_response_cache
+from telemetry import span, record_cache
+from prescorer import blank_result, prescore_answer
+from rate_limit import AsyncRateLimiter
+
+
+def get_retrieved_text(user_response: str, lesson: dict, lesson_id: str | None = None, k: int = RETRIEVAL_K) -> str:
+    # Prefer the precomputed lesson passages: no query embedding call.
+    if lesson_id is not None:
+        chunks = retrieval_chunks(lesson_id, lesson)
+        record_cache("lesson_chunks", "hit" if chunks else "miss")
+        if chunks:
+            with span("retrieval.rerank"):
+                return "\n---\n".join(rerank_chunks(user_response, chunks, k=k))
+    return retrieve_chunks(user_response, k=k)
+
+
+def _cached(user_response: str, lesson: dict, model_choice: str) -> dict | None:
+    cache = get_response_cache()
+    if cache is None:
+        return None
+    return cache.get(user_response, lesson_hash(lesson), model_choice)
+
+
+def _store(user_response: str, lesson: dict, model_choice: str, result: dict):
+    cache = get_response_cache()
+    if cache is not None:
+        cache.put(user_response, lesson_hash(lesson), model_choice, result)
+
+
+def _prompt(user_response: str, retrieved_text: str, lesson: dict, prescore) -> str:
+    # The LLM always judges every key point; a pre-score only adds hints and
+    # trims the context.
+    with span("prompt.build"):
+        if prescore is None:
+            return build_rag_prompt(user_response, retrieved_text, lesson["key_points"])
+        return build_rag_prompt(user_response, retrieved_text, lesson["key_points"],
+                                likely_covered=prescore.covered, likely_missed=prescore.missed)
+
+
+async def _retrieve_and_prescore(user_response: str, lesson: dict, lesson_id: str | None,
+                                 retrieved_text: str | None = None):
+    # Both may embed the answer; run them side by side rather than back to back.
+    if retrieved_text is not None:
+        return retrieved_text, await asyncio.to_thread(prescore_answer, user_response, lesson, lesson_id)
+    return await asyncio.gather(
+        asyncio.to_thread(get_retrieved_text, user_response, lesson, lesson_id),
+        asyncio.to_thread(prescore_answer, user_response, lesson, lesson_id),
+    )
+
+
+def evaluate_response_with_rag(user_response: str, lesson, model_choice: str, lesson_id: str | None = None) -> dict:
+    with span("evaluation", model=model_choice):
+        cached = _cached(user_response, lesson, model_choice)
+        if cached is not None:
+            return cached
+        blank = blank_result(user_response, lesson)
+        if blank is not None:
+            _store(user_response, lesson, model_choice, blank)
+            return blank
+        prescore = prescore_answer(user_response, lesson, lesson_id)
+        retrieved_text = get_retrieved_text(user_response, lesson, lesson_id)
+        prompt = _prompt(user_response, retrieved_text, lesson, prescore)
+        result = evaluate(prompt, model_choice)
+        append_example(prompt, result)
+        _store(user_response, lesson, model_choice, result)
+        return result
+
+
+def evaluate_response_with_rag_stream(user_response: str, lesson, model_choice: str, lesson_id: str | None = None):
+    # Yields (partial, done) pairs; the last one is the validated result.
+    with span("evaluation", model=model_choice):
+        cached = _cached(user_response, lesson, model_choice)
+        if cached is not None:
+            yield cached, True
+            return
+        blank = blank_result(user_response, lesson)
+        if blank is not None:
+            _store(user_response, lesson, model_choice, blank)
+            yield blank, True
+            return
+        prescore = prescore_answer(user_response, lesson, lesson_id)
+        retrieved_text = get_retrieved_text(user_response, lesson, lesson_id)
+        prompt = _prompt(user_response, retrieved_text, lesson, prescore)
+        for result, done in evaluate_stream(prompt, model_choice):
+            if done:
+                append_example(prompt, result)
+                _store(user_response, lesson, model_choice, result)
+            yield result, done
+
+
+async def evaluate_response_with_rag_async(user_response: str, lesson, model_choice: str, lesson_id: str | None = None,
+                                           retrieved_text: str | None = None,
+                                           rate_limiter: AsyncRateLimiter | None = None) -> dict:
+    # Callers grading many answers for one lesson can pass retrieved_text to
+    # share a single retrieval, and a rate_limiter that is charged per LLM
+    # request (cache hits and blank answers cost nothing).
+    with span("evaluation", model=model_choice):
+        cached = await asyncio.to_thread(_cached, user_response, lesson, model_choice)
+        if cached is not None:
+            return cached
+        blank = blank_result(user_response, lesson)
+        if blank is not None:
+            await asyncio.to_thread(_store, user_response, lesson, model_choice, blank)
+            return blank
+        retrieved_text, prescore = await _retrieve_and_prescore(user_response, lesson, lesson_id, retrieved_text)
+        prompt = _prompt(user_response, retrieved_text, lesson, prescore)
+        result = await evaluate_async(prompt, model_choice, rate_limiter=rate_limiter)
+        append_example(prompt, result)
+        await asyncio.to_thread(_store, user_response, lesson, model_choice, result)
+        return result
+
+
+async def evaluate_response_with_rag_stream_async(user_response: str, lesson, model_choice: str,
+                                                  lesson_id: str | None = None):
+    # Async twin of evaluate_response_with_rag_stream for the API server.
+    with span("evaluation", model=model_choice):
+        cached = await asyncio.to_thread(_cached, user_response, lesson, model_choice)
+        if cached is not None:
+            yield cached, True
+            return
+        blank = blank_result(user_response, lesson)
+        if blank is not None:
+            await asyncio.to_thread(_store, user_response, lesson, model_choice, blank)
+            yield blank, True
+            return
+        retrieved_text, prescore = await _retrieve_and_prescore(user_response, lesson, lesson_id)
+        prompt = _prompt(user_response, retrieved_text, lesson, prescore)
+        async for result, done in evaluate_stream_async(prompt, model_choice):
+            if done:
+                append_example(prompt, result)
+                await asyncio.to_thread(_store, user_response, lesson, model_choice, result)
+            yield result, done
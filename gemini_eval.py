@@ -1,90 +1,327 @@
-import vertexai
-import pandas as pd
-from vertexai.evaluation import EvalTask, PointwiseMetric, PointwiseMetricPromptTemplate
-from google.cloud import aiplatform
-
-PROJECT_ID = "model-eval-463217"
-
-vertexai.init(
-    project=PROJECT_ID
-)
-
-custom_text_quality = PointwiseMetric(
-    metric="custom_text-quality",
-    metric_prompt_template=PointwiseMetricPromptTemplate(
-        criteria={
-            "comprehensibility": (
-                
-                    "The AI model does not talk in difficult grammar jargon and hard to understand text, but rather talks to the user "
-                    "at an understandable and basic level. Arabic grammar terms are primarily used as opposed to English ones. Sentences would be comprehensible by a user "
-                    "who doesn't use English as their primary language. The text isn't overcomplicated or confusing, but rather is simple and clear to the reader." 
-                
-            ),
-            "gentleness": (
-                 
-                    "The text does not come across as scolding the user or being overly harsh with them, rather it is gentle and encouraging. The text is encouraging and excites the learner to "
-                    "study further rather than discouraging them or making them feel unworthy. The text offers realistic feedback and doesn't sugarcoat mistakes, while simultaneously being gentle in its "
-                    "approach. The user will come away from reading the text feeling motivated and encouraged."
-                
-            ),
-            "accuracy": (
-                 
-                    "The text is accurate in its feedback. It does not illogically say the user made a mistake where they didn't, and doesn't illogically "
-                    "expect the user to know something unrealistic. The text is accurate to the rules of Arabic grammar, and its critiques of the user "
-                    "are accurate based on the user input. The text should not include critiques just for the sake of having critiques. If there are no "
-                    "critiques the text should reflect that, and if there are legitimate crtiques, the text should reflect that."
-                
-            ),
-            "fluency": (
-
-                    "Sentences flow smoothly and are easy to read, avoiding awkward"
-                    " phrasing or run-on sentences. Ideas and sentences connect"
-                    " logically, using transitions effectively where needed."    
-                            
-            ),
-            "constructiveness": (
-
-                    "The feedback given is useful and accurate. The feedback directly"
-                    " references mistakes the user made (or things done well). If mistakes"
-                    " were made, the model corrects them and outputs feedback on how to "
-                    "avoid the mistake going forward."
-
-            )
-        },
-        rating_rubric={
-            
-                "5": "(Very good). Exceptionally clear, coherent, fluent, and concise. Fully adheres to instructions and stays grounded.",
-                "4": "(Good). Well-written, coherent, and fluent. Mostly adheres to instructions and stays grounded. Minor room for improvement.",
-                "3": "(Ok). Adequate writing with decent coherence and fluency. Partially fulfills instructions and may contain minor ungrounded information. Could be more concise.",
-                "2": "(Bad). Poorly written, lacking coherence and fluency. Struggles to adhere to instructions and may include ungrounded information. Issues with conciseness.",
-                "1": "(Very bad). Very poorly written, incoherent, and non-fluent. Fails to follow instructions and contains substantial ungrounded information. Severely lacking in conciseness."
-            
-        },
+import os
+import re
+import csv
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import argparse
+import importlib
+import threading
+
+from dotenv import load_dotenv
+
+from rate_limit import AsyncRateLimiter
+from evaluation_logger import EVAL_CSV_PATH, iter_examples
+from structured_output import extract_json
+
+load_dotenv()
+
+PROJECT_ID = os.getenv("VERTEX_PROJECT_ID", "model-eval-463217")
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+JUDGE_SCORES_PATH = os.getenv("JUDGE_SCORES_PATH", os.path.join(BASE_DIR, ".cache", "judge_scores.sqlite"))
+METRIC_NAME = "custom_text-quality"
+# Bump to force a re-score when the judging changes in a way the criteria
+# text doesn't show (e.g. a different judge model).
+METRIC_REVISION = 1
+
+CRITERIA = {
+    "comprehensibility": (
+        "The AI model does not talk in difficult grammar jargon and hard to understand text, but rather talks to the user "
+        "at an understandable and basic level. Arabic grammar terms are primarily used as opposed to English ones. Sentences would be comprehensible by a user "
+        "who doesn't use English as their primary language. The text isn't overcomplicated or confusing, but rather is simple and clear to the reader."
+    ),
+    "gentleness": (
+        "The text does not come across as scolding the user or being overly harsh with them, rather it is gentle and encouraging. The text is encouraging and excites the learner to "
+        "study further rather than discouraging them or making them feel unworthy. The text offers realistic feedback and doesn't sugarcoat mistakes, while simultaneously being gentle in its "
+        "approach. The user will come away from reading the text feeling motivated and encouraged."
+    ),
+    "accuracy": (
+        "The text is accurate in its feedback. It does not illogically say the user made a mistake where they didn't, and doesn't illogically "
+        "expect the user to know something unrealistic. The text is accurate to the rules of Arabic grammar, and its critiques of the user "
+        "are accurate based on the user input. The text should not include critiques just for the sake of having critiques. If there are no "
+        "critiques the text should reflect that, and if there are legitimate crtiques, the text should reflect that."
     ),
-)
+    "fluency": (
+        "Sentences flow smoothly and are easy to read, avoiding awkward"
+        " phrasing or run-on sentences. Ideas and sentences connect"
+        " logically, using transitions effectively where needed."
+    ),
+    "constructiveness": (
+        "The feedback given is useful and accurate. The feedback directly"
+        " references mistakes the user made (or things done well). If mistakes"
+        " were made, the model corrects them and outputs feedback on how to "
+        "avoid the mistake going forward."
+    ),
+}
+
+RATING_RUBRIC = {
+    "5": "(Very good). Exceptionally clear, coherent, fluent, and concise. Fully adheres to instructions and stays grounded.",
+    "4": "(Good). Well-written, coherent, and fluent. Mostly adheres to instructions and stays grounded. Minor room for improvement.",
+    "3": "(Ok). Adequate writing with decent coherence and fluency. Partially fulfills instructions and may contain minor ungrounded information. Could be more concise.",
+    "2": "(Bad). Poorly written, lacking coherence and fluency. Struggles to adhere to instructions and may include ungrounded information. Issues with conciseness.",
+    "1": "(Very bad). Very poorly written, incoherent, and non-fluent. Fails to follow instructions and contains substantial ungrounded information. Severely lacking in conciseness.",
+}
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def metric_version(judge) -> str:
+    # Scores are only reused while the criteria, rubric and judge are unchanged.
+    fields = {"criteria": CRITERIA, "rubric": RATING_RUBRIC, "judge": judge.name, "revision": METRIC_REVISION}
+    # A judge's own scoring changes invalidate only that judge's scores.
+    if getattr(judge, "revision", None):
+        fields["judge_revision"] = judge.revision
+    payload = json.dumps(fields, sort_keys=True)
+    return f"{METRIC_NAME}@{text_hash(payload)[:12]}"
+
+
+class VertexJudge:
+    # Vertex AI pointwise LLM judge. Vertex is initialized on first use, not
+    # at import, and no experiment run is created.
+
+    name = "vertex"
+
+    def __init__(self, project: str = PROJECT_ID):
+        import vertexai
+        from vertexai.evaluation import PointwiseMetric, PointwiseMetricPromptTemplate
+
+        vertexai.init(project=project)
+        self.metric = PointwiseMetric(
+            metric=METRIC_NAME,
+            metric_prompt_template=PointwiseMetricPromptTemplate(criteria=CRITERIA, rating_rubric=RATING_RUBRIC),
+        )
+
+    def score_batch(self, rows: list[tuple[str, str]]) -> list[dict]:
+        import pandas as pd
+        from vertexai.evaluation import EvalTask
+
+        dataset = pd.DataFrame(rows, columns=["prompt", "response"])
+        table = EvalTask(dataset=dataset, metrics=[self.metric]).evaluate().metrics_table
+        return [
+            {"score": float(row[f"{METRIC_NAME}/score"]), "explanation": str(row[f"{METRIC_NAME}/explanation"])}
+            for _, row in table.iterrows()
+        ]
+
+
+_SENTENCE_RE = re.compile(r"[^.!?\n]+")
+# Whole words only, each term once: "fail" must not also count inside
+# "failed", nor "bad" inside "Baddeley".
+_HARSH_RE = re.compile(r"\b(?:wrong|fail(?:s|ed|ure)?|poor|bad|terrible|careless|unacceptable|should have known)\b")
+_ENCOURAGING_RE = re.compile(r"\b(?:great|good|well done|excellent|keep|nice|progress|try)\b")
+_ADVICE_RE = re.compile(r"\b(?:remember|review|next time|try|focus)\b")
+
+
+class LocalJudge:
+    # Deterministic offline stand-in with the same 1-5 scale, for running the
+    # pipeline without Vertex credentials. Not a substitute for real quality runs.
+
+    name = "local"
+    revision = 2
+
+    def score_one(self, prompt: str, response: str) -> dict:
+        # Older logs hold Python-repr dicts; the tolerant parser reads both.
+        data = extract_json(response)
+        if data is None:
+            return {"score": 1.0, "explanation": "response is not a JSON object"}
+        feedback = str(data.get("generated_feedback") or "")
+        lowered = feedback.lower()
+        sentences = [s for s in _SENTENCE_RE.findall(feedback) if s.strip()]
+        words_per_sentence = [len(s.split()) for s in sentences] or [0]
+        notes = []
+        scores = {}
+
+        average = sum(words_per_sentence) / len(words_per_sentence)
+        scores["comprehensibility"] = 5 if average <= 20 else 3 if average <= 30 else 2
+        if average > 20:
+            notes.append(f"long sentences ({average:.0f} words on average)")
+
+        harsh = len(_HARSH_RE.findall(lowered))
+        encouraging = len(_ENCOURAGING_RE.findall(lowered))
+        scores["gentleness"] = max(1, min(5, 4 + (encouraging > 0) - harsh))
+        if harsh:
+            notes.append(f"{harsh} harsh phrase(s)")
+
+        # A perfect score with missed points (or the reverse) is inconsistent.
+        # Fields may be present but null in logged responses.
+        problems = len(data.get("incorrect_points") or []) + len(data.get("missed_points") or [])
+        score = data.get("score") or 0
+        consistent = (score >= 90) == (problems == 0)
+        scores["accuracy"] = 5 if consistent else 2
+        if not consistent:
+            notes.append(f"score {score} disagrees with {problems} listed problem(s)")
+
+        scores["fluency"] = 5 if max(words_per_sentence) <= 40 else 3
+        if max(words_per_sentence) > 40:
+            notes.append("run-on sentence")
+
+        constructive = bool(feedback) and bool(data.get("rewritten_answer")) and (
+            problems == 0 or _ADVICE_RE.search(lowered) is not None
+        )
+        scores["constructiveness"] = 5 if constructive else 2
+        if not constructive:
+            notes.append("no concrete advice")
+
+        overall = round(sum(scores.values()) / len(scores), 2)
+        return {"score": overall, "explanation": "; ".join(notes) or "no issues found"}
+
+    def score_batch(self, rows: list[tuple[str, str]]) -> list[dict]:
+        return [self.score_one(prompt, response) for prompt, response in rows]
+
+
+JUDGES = {"vertex": VertexJudge, "local": LocalJudge}
+
+
+def load_judge(spec: str):
+    # "vertex", "local", or "package.module:ClassName" for a custom judge with
+    # a `name` and a `score_batch(rows) -> [{"score", "explanation"}]`.
+    if spec in JUDGES:
+        return JUDGES[spec]()
+    module_name, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attr)()
+
+
+class ScoreStore:
+    # Judge scores keyed by (prompt hash, response hash, metric version), so a
+    # re-run only sends rows that were never scored under this metric.
+
+    def __init__(self, path: str = JUDGE_SCORES_PATH):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS judge_scores ("
+            "prompt_hash TEXT NOT NULL, response_hash TEXT NOT NULL, metric_version TEXT NOT NULL, "
+            "score REAL NOT NULL, explanation TEXT NOT NULL, scored_at REAL NOT NULL, "
+            "PRIMARY KEY (prompt_hash, response_hash, metric_version))"
+        )
+
+    def get_many(self, keys: list[tuple[str, str]], version: str) -> dict[tuple[str, str], dict]:
+        found = {}
+        with self._lock:
+            for prompt_hash, response_hash in keys:
+                row = self._conn.execute(
+                    "SELECT score, explanation FROM judge_scores "
+                    "WHERE prompt_hash = ? AND response_hash = ? AND metric_version = ?",
+                    (prompt_hash, response_hash, version),
+                ).fetchone()
+                if row is not None:
+                    found[(prompt_hash, response_hash)] = {"score": row[0], "explanation": row[1]}
+        return found
+
+    def put_many(self, version: str, items: list[tuple[tuple[str, str], dict]]):
+        now = time.time()
+        rows = [(p, r, version, result["score"], result["explanation"], now) for (p, r), result in items]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT OR REPLACE INTO judge_scores VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._conn.execute("COMMIT")
+
+
+def iter_chunks(path: str, chunk_size: int):
+    # Yields lists of (prompt, response) without loading the dataset at once.
+    # Reads the CSV export or the JSONL evaluation log directly.
+    chunk = []
+    for row in _iter_rows(path):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _iter_rows(path: str):
+    if path.endswith(".jsonl"):
+        for record in iter_examples(path):
+            yield record["prompt"], json.dumps(record["response"], ensure_ascii=False)
+        return
+    with open(path, encoding="utf-8", newline="") as f:
+        for record in csv.DictReader(f):
+            yield record["prompt"], record["response"]
+
+
+async def run_eval(input_path: str, judge, store: ScoreStore, out_path: str, chunk_size: int = 500,
+                   concurrency: int = 4, batch_size: int = 8, requests_per_minute: float = 60.0) -> dict:
+    version = metric_version(judge)
+    limiter = AsyncRateLimiter(requests_per_minute, burst=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    summary = {"rows": 0, "written": 0, "reused": 0, "scored": 0, "failed": 0, "score_sum": 0.0}
+
+    async def score(batch: list[tuple[tuple[str, str], tuple[str, str]]]) -> dict:
+        async with semaphore:
+            for _ in batch:
+                await limiter.acquire()
+            try:
+                results = await asyncio.to_thread(judge.score_batch, [row for _, row in batch])
+            except Exception as e:
+                # Left unscored; the next run retries these rows.
+                print(f"Judge batch of {len(batch)} failed: {type(e).__name__}: {e}")
+                summary["failed"] += len(batch)
+                return {}
+        scored = list(zip((key for key, _ in batch), results))
+        await asyncio.to_thread(store.put_many, version, scored)
+        summary["scored"] += len(scored)
+        return dict(scored)
 
-responses = [
-    """
-    {'score': 100, 'correct_points': ["You correctly identified the three cases in Arabic: Raf', Nasb, and Jarr.", "You correctly stated that Raf' is used for the subject, predicate, and doer.", 'You correctly stated that Jarr is used after prepositions.', 'You correctly stated that Nasb is used for the done-to and after certain huruf.'], 'incorrect_points': [], 'missed_points': [], 'generated_feedback': 'Excellent work! You have perfectly recalled all the key information about the three Arabic cases and their primary uses. Your answer is complete and accurate based on the provided material. Keep up the great work!', 'rewritten_answer': "Arabic has 3 cases: Raf', nasb, and jarr. Raf' is used for the subject, the predicate, and the doer. Jarr is used after prepositions. Nasb is used for the done-to and after certain huruf."}
-    """,
-]
+    with open(out_path, "w", encoding="utf-8", newline="") as out:
+        writer = csv.writer(out)
+        writer.writerow(["prompt_hash", "response_hash", "metric_version", "score", "explanation"])
+        for chunk in iter_chunks(input_path, chunk_size):
+            keys = [(text_hash(prompt), text_hash(response)) for prompt, response in chunk]
+            known = await asyncio.to_thread(store.get_many, keys, version)
+            pending = {}
+            for key, row in zip(keys, chunk):
+                if key not in known:
+                    pending.setdefault(key, row)
+            summary["reused"] += sum(1 for key in keys if key in known)
+            items = list(pending.items())
+            batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+            for scored in await asyncio.gather(*(score(batch) for batch in batches)):
+                known.update(scored)
+            for key in keys:
+                result = known.get(key)
+                if result is not None:
+                    writer.writerow([*key, version, result["score"], result["explanation"]])
+                    summary["written"] += 1
+                    summary["score_sum"] += result["score"]
+            summary["rows"] += len(chunk)
 
-eval_dataset = pd.read_csv("eval_dataset.csv")
+    # "failed" counts distinct rows sent to the judge, "rows" every input row
+    # (duplicates included); only the rows written out have a score.
+    score_sum = summary.pop("score_sum")
+    summary["mean_score"] = round(score_sum / summary["written"], 3) if summary["written"] else None
+    summary["metric_version"] = version
+    return summary
 
-eval_task = EvalTask(
-    dataset=eval_dataset,
-    metrics=[custom_text_quality],
-    experiment="myexperiment"
-)
 
-pointwise_result = eval_task.evaluate()
+def main():
+    parser = argparse.ArgumentParser(description="Score logged evaluations with an LLM judge, reusing stored scores.")
+    parser.add_argument("input", nargs="?", default=EVAL_CSV_PATH, help="eval_dataset.csv or the JSONL evaluation log")
+    parser.add_argument("--out", default="eval_results.csv")
+    parser.add_argument("--judge", default="vertex", help="vertex, local, or module:Class")
+    parser.add_argument("--scores", default=JUDGE_SCORES_PATH, help="SQLite store of judge scores")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=8, help="rows per judge call")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=60.0, help="max judged rows per minute")
+    args = parser.parse_args()
 
-print(pointwise_result.metrics_table)
+    judge = load_judge(args.judge)
+    summary = asyncio.run(run_eval(
+        args.input, judge, ScoreStore(args.scores), args.out,
+        args.chunk_size, args.concurrency, args.batch_size, args.rate,
+    ))
+    print(json.dumps(summary, indent=2))
+    print(f"Per-row scores written to {args.out}")
 
-with open("eval_results.txt", "w") as f:
-    f.write(pointwise_result.metrics_table.to_string())
 
-aiplatform.ExperimentRun(
-    run_name=pointwise_result.metadata["experiment_run"],
-    experiment = pointwise_result.metadata["experiment"],
-).delete()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import os
+import re
+import math
+import unicodedata
+from array import array
+
+import numpy as np
+
+RRF_K = 60
+RERANKER_MODEL = os.getenv("RERANKER_MODEL")  # e.g. cross-encoder/mmarco-mMiniLMv2-L12-H384-v1
+
+_TOKEN_RE = re.compile(r"[\w'ʿʾ`’]+", re.UNICODE)
+_TASHKEEL_RE = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+_ARABIC_RE = re.compile("[\u0600-\u06ff]")
+_APOSTROPHES_RE = re.compile("['ʿʾ`’]")
+_CHAR_MAP = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ى": "ي", "ئ": "ي",
+    "ؤ": "و",
+    "ة": "ه",
+})
+_ARTICLE_PREFIXES = ("وال", "بال", "فال", "كال", "ال", "لل")
+
+# Transliterations students use for grammar terms, mapped to the normalized
+# Arabic token the textbook uses. Keys are lowercase with apostrophes removed.
+TRANSLITERATIONS = {
+    "raf": "رفع", "rafa": "رفع", "marfu": "مرفوع", "marfoo": "مرفوع",
+    "nasb": "نصب", "mansub": "منصوب", "mansoob": "منصوب",
+    "jarr": "جر", "jar": "جر", "majrur": "مجرور", "majroor": "مجرور",
+    "irab": "اعراب", "iraab": "اعراب",
+    "damma": "ضمه", "dammah": "ضمه", "dammatan": "ضمتان",
+    "fatha": "فتحه", "fathah": "فتحه", "fathatan": "فتحتان",
+    "kasra": "كسره", "kasrah": "كسره", "kasratan": "كسرتان",
+    "harf": "حرف", "huruf": "حروف", "huroof": "حروف",
+    "ism": "اسم", "fil": "فعل", "afal": "افعال",
+    "damir": "ضمير", "dameer": "ضمير", "dhamir": "ضمير",
+    "mustatir": "مستتر", "munfasil": "منفصل", "muttasil": "متصل",
+    "mubtada": "مبتدا", "khabar": "خبر",
+    "fail": "فاعل", "faail": "فاعل", "maful": "مفعول", "mafool": "مفعول",
+    "idafa": "اضافه", "idhafa": "اضافه", "idhaafa": "اضافه", "idaafa": "اضافه",
+}
+
+
+def normalize_arabic(text: str) -> str:
+    # Strip diacritics and tatweel, unify alef/ya/ta marbuta variants.
+    return _TASHKEEL_RE.sub("", unicodedata.normalize("NFC", text)).translate(_CHAR_MAP)
+
+
+def _strip_article(token: str) -> str:
+    for prefix in _ARTICLE_PREFIXES:
+        if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+            return token[len(prefix):]
+    return token
+
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for raw in _TOKEN_RE.findall(normalize_arabic(text)):
+        if _ARABIC_RE.search(raw):
+            tokens.append(_strip_article(_APOSTROPHES_RE.sub("", raw)))
+            continue
+        # Latin: fold accents (rafʿ, naṣb) and apostrophes, then map known
+        # transliterations onto their Arabic form.
+        latin = unicodedata.normalize("NFKD", raw.lower())
+        latin = "".join(char for char in latin if not unicodedata.combining(char))
+        latin = _APOSTROPHES_RE.sub("", latin)
+        if latin:
+            tokens.append(_strip_article(TRANSLITERATIONS[latin]) if latin in TRANSLITERATIONS else latin)
+    return tokens
+
+
+class BM25Index:
+    # Postings are stored CSR-style in flat typed arrays (one offsets array,
+    # one doc-id array, one term-frequency array) rather than per-term lists.
+
+    def __init__(self, texts, k1: float = 1.2, b: float = 0.75):
+        # texts may be any iterable (e.g. streamed from the docstore); only
+        # the postings are kept, never the texts themselves.
+        self.k1 = k1
+        self.b = b
+        postings = {}
+        lengths = array("I")
+        for doc_id, text in enumerate(texts):
+            counts = {}
+            tokens = tokenize(text)
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            lengths.append(len(tokens))
+            for token, count in counts.items():
+                ids, tfs = postings.setdefault(token, (array("I"), array("H")))
+                ids.append(doc_id)
+                tfs.append(min(count, 65535))
+
+        self.vocabulary = {}
+        offsets = array("Q", [0])
+        doc_ids = array("I")
+        tfs = array("H")
+        for term_id, (token, (ids, counts)) in enumerate(postings.items()):
+            self.vocabulary[token] = term_id
+            doc_ids.extend(ids)
+            tfs.extend(counts)
+            offsets.append(len(doc_ids))
+
+        self.offsets = np.frombuffer(offsets, dtype=np.uint64)
+        self.doc_ids = np.frombuffer(doc_ids, dtype=np.uint32)
+        self.tfs = np.frombuffer(tfs, dtype=np.uint16)
+        self.lengths = np.frombuffer(lengths, dtype=np.uint32).astype(np.float32)
+        self.size = len(lengths)
+        self.avg_length = float(self.lengths.mean()) if self.size else 0.0
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(self.size, dtype=np.float32)
+        if not self.size:
+            return scores
+        norm = self.k1 * (1 - self.b + self.b * self.lengths / (self.avg_length or 1.0))
+        for token in set(tokenize(query)):
+            term_id = self.vocabulary.get(token)
+            if term_id is None:
+                continue
+            start, stop = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+            ids = self.doc_ids[start:stop]
+            tf = self.tfs[start:stop].astype(np.float32)
+            df = stop - start
+            idf = math.log(1 + (self.size - df + 0.5) / (df + 0.5))
+            scores[ids] += idf * tf * (self.k1 + 1) / (tf + norm[ids])
+        return scores
+
+    def search(self, query: str, k: int) -> list[tuple[int, float]]:
+        scores = self.scores(query)
+        if not self.size:
+            return []
+        k = min(k, self.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top if scores[i] > 0]
+
+
+class CrossEncoderReranker:
+
+    def __init__(self, model_name: str):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError as e:
+            raise ImportError(
+                "Re-ranking needs sentence-transformers: pip install sentence-transformers"
+            ) from e
+        self._model = CrossEncoder(model_name, device="cpu")
+
+    def rerank(self, query: str, docs: list, k: int) -> list:
+        if not docs:
+            return docs
+        scores = self._model.predict([(query, doc.page_content) for doc in docs])
+        order = sorted(range(len(docs)), key=lambda i: -float(scores[i]))
+        return [docs[i] for i in order[:k]]
+
+
+class HybridRetriever:
+    # Fuses FAISS (dense) and BM25 (lexical, Arabic-normalized) rankings with
+    # reciprocal rank fusion, then optionally re-ranks with a cross-encoder.
+    # Both rankings are over index positions; only the fused top hits are
+    # read from the docstore, so document text stays in the shared, memory-
+    # mapped SQLite file instead of each worker's heap.
+
+    def __init__(self, db, reranker: CrossEncoderReranker | None = None):
+        self.db = db
+        self.reranker = reranker
+        if hasattr(db.docstore, "iter_documents"):
+            texts = (doc.page_content for doc in db.docstore.iter_documents())
+        else:
+            texts = (db.docstore.search(doc_id).page_content for doc_id in db.index_to_docstore_id.values())
+        self.bm25 = BM25Index(texts)
+
+    def _dense(self, query: str, k: int) -> list[int]:
+        vector = np.asarray([self.db.embedding_function.embed_query(query)], dtype=np.float32)
+        if getattr(self.db, "_normalize_L2", False):
+            import faiss
+
+            faiss.normalize_L2(vector)
+        _, positions = self.db.index.search(vector, k)
+        return [int(position) for position in positions[0] if position >= 0]
+
+    def _documents(self, positions: list[int], limit: int) -> list:
+        # Overlapping chunks can repeat the same text under different ids.
+        docs, seen = [], set()
+        for position in positions:
+            doc = self.db.docstore.search(self.db.index_to_docstore_id[position])
+            if doc.page_content not in seen:
+                seen.add(doc.page_content)
+                docs.append(doc)
+            if len(docs) == limit:
+                break
+        return docs
+
+    def search(self, query: str, k: int = 3, fetch_k: int = 20) -> list:
+        fused = {}
+        for rank, position in enumerate(self._dense(query, fetch_k)):
+            fused[position] = fused.get(position, 0.0) + 1.0 / (RRF_K + rank + 1)
+        for rank, (position, _) in enumerate(self.bm25.search(query, fetch_k)):
+            fused[position] = fused.get(position, 0.0) + 1.0 / (RRF_K + rank + 1)
+        ranked = [position for position, _ in sorted(fused.items(), key=lambda item: -item[1])]
+        if self.reranker is not None:
+            return self.reranker.rerank(query, self._documents(ranked, fetch_k), k)
+        return self._documents(ranked, k)
+
+
+_reranker = None
+
+
+def get_reranker() -> CrossEncoderReranker | None:
+    global _reranker
+    if RERANKER_MODEL and _reranker is None:
+        _reranker = CrossEncoderReranker(RERANKER_MODEL)
+    return _reranker
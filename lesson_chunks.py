@@ -0,0 +1,52 @@
+import json
+import hashlib
+
+from hybrid_retriever import tokenize
+
+
+def lesson_hash(lesson: dict) -> str:
+    payload = json.dumps(
+        {"content": lesson["content"], "key_points": lesson["key_points"]},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def lesson_queries(lesson: dict) -> list[str]:
+    return [lesson["content"].strip(), *lesson["key_points"]]
+
+
+def build_lesson_chunks(lesson: dict, db, per_query: int = 4, max_chunks: int = 8) -> list[str]:
+    # Search with the lesson body and each key point and keep the best-scoring
+    # unique chunks (FAISS returns L2 distance: lower is closer).
+    best = {}
+    for query in lesson_queries(lesson):
+        for doc, distance in db.similarity_search_with_score(query, k=per_query):
+            text = doc.page_content
+            distance = float(distance)
+            if text not in best or distance < best[text]:
+                best[text] = distance
+    ranked = sorted(best.items(), key=lambda item: item[1])[:max_chunks]
+    return [text for text, _ in ranked]
+
+
+def _tokens(text: str) -> set[str]:
+    # Arabic-normalized, so "raf'" in an answer matches الرفع in a chunk.
+    return set(tokenize(text))
+
+
+def rerank_chunks(user_response: str, chunks: list[str], k: int = 4) -> list[str]:
+    # Cheap local re-rank: term overlap with the student's answer, ties broken
+    # by the precomputed order. No embedding call involved.
+    answer_tokens = _tokens(user_response)
+    if not answer_tokens:
+        return chunks[:k]
+    scored = []
+    for position, chunk in enumerate(chunks):
+        chunk_tokens = _tokens(chunk)
+        overlap = len(answer_tokens & chunk_tokens) / (len(chunk_tokens) ** 0.5 or 1)
+        scored.append((-overlap, position, chunk))
+    scored.sort()
+    return [chunk for _, _, chunk in scored[:k]]
+
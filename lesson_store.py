@@ -0,0 +1,335 @@
+import os
+import json
+import time
+import argparse
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import (
+    Column, Float, Integer, LargeBinary, MetaData, String, Table, Text, create_engine, delete, event, func, select,
+)
+from sqlalchemy.dialects.sqlite import insert
+
+from lesson_chunks import lesson_hash
+
+load_dotenv()
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LESSON_DB_URL = os.getenv("LESSON_DB_URL", f"sqlite:///{os.path.join(BASE_DIR, 'rag', 'lessons.sqlite')}")
+LESSON_CACHE_SIZE = int(os.getenv("LESSON_CACHE_SIZE", "64"))
+# Bump when an artifact's format or the way it is computed changes.
+ARTIFACT_VERSIONS = {"key_point_embeddings": 1, "retrieval_hints": 2}
+
+metadata = MetaData()
+
+lessons_table = Table(
+    "lessons", metadata,
+    Column("id", String, primary_key=True),
+    Column("position", Integer, nullable=False, index=True),
+    Column("title", Text, nullable=False),
+    Column("content", Text, nullable=False),
+    Column("key_points", Text, nullable=False),
+    Column("content_hash", String, nullable=False),
+    Column("updated_at", Float, nullable=False),
+)
+
+# Derived data per lesson. Rows are only valid while content_hash matches the
+# lesson's current hash, so editing a lesson never serves stale artifacts.
+artifacts_table = Table(
+    "lesson_artifacts", metadata,
+    Column("lesson_id", String, primary_key=True),
+    Column("kind", String, primary_key=True),
+    Column("version", String, primary_key=True),
+    Column("content_hash", String, nullable=False),
+    Column("payload", LargeBinary, nullable=False),
+    Column("created_at", Float, nullable=False),
+)
+
+
+def artifact_version(kind: str, model_name: str | None = None) -> str:
+    version = f"v{ARTIFACT_VERSIONS[kind]}"
+    return f"{version}:{model_name}" if model_name else version
+
+
+class LessonStore:
+    # Lessons live in a SQLite catalog (via SQLAlchemy). List views read a
+    # compact (id, title) index; full lessons are loaded by id on demand and
+    # kept in a small LRU, so memory stays flat as the curriculum grows.
+
+    def __init__(self, url: str = LESSON_DB_URL, cache_size: int = LESSON_CACHE_SIZE, check_interval: float = 5.0):
+        self.url = url
+        self.check_interval = check_interval
+        if url.startswith("sqlite:///") and url != "sqlite:///:memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(url[len("sqlite:///"):])), exist_ok=True)
+        self.engine = create_engine(url, connect_args={"check_same_thread": False} if url.startswith("sqlite") else {})
+        if url.startswith("sqlite"):
+            event.listen(self.engine, "connect", _sqlite_pragmas)
+        metadata.create_all(self.engine)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._index = None
+        self._stamp = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _catalog_stamp(self, conn) -> tuple:
+        return tuple(conn.execute(select(func.count(), func.max(lessons_table.c.updated_at))).one())
+
+    def _sync(self, conn=None):
+        # Another process (or the seed CLI) may have edited the catalog;
+        # checked at most every check_interval seconds.
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        if conn is None:
+            with self.engine.connect() as conn:
+                stamp = self._catalog_stamp(conn)
+        else:
+            stamp = self._catalog_stamp(conn)
+        if stamp != self._stamp:
+            self._stamp = stamp
+            self._index = None
+            self._cache.clear()
+
+    def invalidate(self):
+        with self._lock:
+            self._last_check = 0.0
+            self._stamp = None
+
+    def index(self) -> list[tuple[str, str]]:
+        with self._lock, self.engine.connect() as conn:
+            self._sync(conn)
+            if self._index is None:
+                rows = conn.execute(
+                    select(lessons_table.c.id, lessons_table.c.title).order_by(lessons_table.c.position, lessons_table.c.id)
+                )
+                self._index = [(lesson_id, title) for lesson_id, title in rows]
+            return self._index
+
+    def get(self, lesson_id: str) -> dict | None:
+        with self._lock:
+            self._sync()
+            if lesson_id in self._cache:
+                self._cache.move_to_end(lesson_id)
+                return self._cache[lesson_id]
+            with self.engine.connect() as conn:
+                row = conn.execute(
+                    select(lessons_table.c.title, lessons_table.c.content, lessons_table.c.key_points,
+                           lessons_table.c.content_hash).where(lessons_table.c.id == lesson_id)
+                ).one_or_none()
+            if row is None:
+                return None
+            lesson = {
+                "title": row.title,
+                "content": row.content,
+                "key_points": json.loads(row.key_points),
+                "content_hash": row.content_hash,
+            }
+            self._cache[lesson_id] = lesson
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return lesson
+
+    def put_many(self, lessons: dict) -> int:
+        # Upserts; returns how many lessons were added or changed. New lessons
+        # are appended to the list order, existing ones keep their place.
+        changed = 0
+        now = time.time()
+        with self.engine.begin() as conn:
+            current = {row.id: row for row in conn.execute(
+                select(lessons_table.c.id, lessons_table.c.content_hash, lessons_table.c.position, lessons_table.c.title)
+            )}
+            next_position = max((row.position for row in current.values()), default=-1) + 1
+            for lesson_id, lesson in lessons.items():
+                content_hash = lesson_hash(lesson)
+                existing = current.get(lesson_id)
+                if existing is not None and existing.content_hash == content_hash and existing.title == lesson["title"]:
+                    continue
+                if existing is not None:
+                    position = existing.position
+                else:
+                    position, next_position = next_position, next_position + 1
+                values = {
+                    "position": position,
+                    "title": lesson["title"],
+                    "content": lesson["content"],
+                    "key_points": json.dumps(lesson["key_points"], ensure_ascii=False),
+                    "content_hash": content_hash,
+                    "updated_at": now,
+                }
+                conn.execute(
+                    insert(lessons_table).values(id=lesson_id, **values)
+                    .on_conflict_do_update(index_elements=["id"], set_=values)
+                )
+                # Artifacts of the old content are dead weight now.
+                conn.execute(delete(artifacts_table).where(
+                    artifacts_table.c.lesson_id == lesson_id, artifacts_table.c.content_hash != content_hash
+                ))
+                changed += 1
+        if changed:
+            self.invalidate()
+        return changed
+
+    def __len__(self) -> int:
+        with self.engine.connect() as conn:
+            return conn.execute(select(func.count()).select_from(lessons_table)).scalar_one()
+
+    def get_artifact(self, lesson_id: str, kind: str, version: str, content_hash: str) -> bytes | None:
+        with self.engine.connect() as conn:
+            return conn.execute(
+                select(artifacts_table.c.payload).where(
+                    artifacts_table.c.lesson_id == lesson_id,
+                    artifacts_table.c.kind == kind,
+                    artifacts_table.c.version == version,
+                    artifacts_table.c.content_hash == content_hash,
+                )
+            ).scalar_one_or_none()
+
+    def put_artifact(self, lesson_id: str, kind: str, version: str, content_hash: str, payload: bytes):
+        values = {"content_hash": content_hash, "payload": payload, "created_at": time.time()}
+        with self.engine.begin() as conn:
+            conn.execute(
+                insert(artifacts_table).values(lesson_id=lesson_id, kind=kind, version=version, **values)
+                .on_conflict_do_update(index_elements=["lesson_id", "kind", "version"], set_=values)
+            )
+
+    def key_point_embeddings(self, lesson_id: str, lesson: dict, embeddings) -> np.ndarray:
+        # (n_key_points, dim) float32, unit-normalized. Computed once per
+        # lesson content and embedding model, then read from the catalog.
+        model_name = getattr(embeddings, "model_name", None) or getattr(embeddings, "model", None) or type(embeddings).__name__
+        version = artifact_version("key_point_embeddings", model_name)
+        content_hash = lesson.get("content_hash") or lesson_hash(lesson)
+        payload = self.get_artifact(lesson_id, "key_point_embeddings", version, content_hash)
+        if payload is not None:
+            return np.frombuffer(payload, dtype=np.float32).reshape(len(lesson["key_points"]), -1)
+        vectors = np.asarray(embeddings.embed_documents(lesson["key_points"]), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        self.put_artifact(lesson_id, "key_point_embeddings", version, content_hash, vectors.tobytes())
+        return vectors
+
+    def retrieval_hints(self, lesson_id: str, lesson: dict, store_fingerprint: str) -> list[str] | None:
+        # Passages are only valid for the vector store build they came from.
+        content_hash = lesson.get("content_hash") or lesson_hash(lesson)
+        version = artifact_version("retrieval_hints", store_fingerprint)
+        payload = self.get_artifact(lesson_id, "retrieval_hints", version, content_hash)
+        return json.loads(payload) if payload is not None else None
+
+    def build_retrieval_hints(self, db, store_fingerprint: str, lesson_ids: list[str] | None = None) -> int:
+        from lesson_chunks import build_lesson_chunks
+
+        version = artifact_version("retrieval_hints", store_fingerprint)
+        built = 0
+        for lesson_id in lesson_ids or [lesson_id for lesson_id, _ in self.index()]:
+            lesson = self.get(lesson_id)
+            payload = json.dumps(build_lesson_chunks(lesson, db), ensure_ascii=False).encode("utf-8")
+            self.put_artifact(lesson_id, "retrieval_hints", version, lesson["content_hash"], payload)
+            built += 1
+        # Hints for earlier store builds can never match again.
+        with self.engine.begin() as conn:
+            conn.execute(delete(artifacts_table).where(
+                artifacts_table.c.kind == "retrieval_hints", artifacts_table.c.version != version
+            ))
+        return built
+
+def _sqlite_pragmas(dbapi_conn, _):
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+class LessonMapping(Mapping):
+    # Read-only dict view over the store for code written against LESSONS.
+    # Iteration walks the index; values are loaded lazily.
+
+    def __init__(self, store: LessonStore):
+        self.store = store
+
+    def __getitem__(self, lesson_id: str) -> dict:
+        lesson = self.store.get(lesson_id)
+        if lesson is None:
+            raise KeyError(lesson_id)
+        return lesson
+
+    def __iter__(self):
+        return (lesson_id for lesson_id, _ in self.store.index())
+
+    def __len__(self) -> int:
+        return len(self.store.index())
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_lesson_store(url: str = LESSON_DB_URL) -> LessonStore:
+    global _store
+    with _store_lock:
+        if _store is None or _store.url != url:
+            _store = LessonStore(url)
+            if not _store.index():
+                # First run: seed the catalog from the bundled lessons.
+                from lessons import LESSONS
+
+                _store.put_many(LESSONS)
+        return _store
+
+
+def get_lessons() -> LessonMapping:
+    return LessonMapping(get_lesson_store())
+
+
+def retrieval_chunks(lesson_id: str, lesson: dict) -> list[str] | None:
+    # Precomputed passages for a lesson, built against the store that is
+    # being served. None means retrieve live.
+    from retriever import get_retriever
+
+    service = get_retriever()
+    service.get_store()
+    if service.fingerprint is None:
+        return None
+    return get_lesson_store().retrieval_hints(lesson_id, lesson, service.fingerprint)
+
+def load_lesson_file(path: str) -> dict:
+    # JSON object of {lesson_id: {title, content, key_points}} or a JSONL of
+    # {"id", "title", "content", "key_points"} rows.
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            rows = [json.loads(line) for line in f if line.strip()]
+            return {row.pop("id"): row for row in rows}
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the lesson catalog.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    seed = commands.add_parser("seed", help="add or update lessons (default: the bundled lessons.py)")
+    seed.add_argument("path", nargs="?", help="JSON or JSONL lesson file")
+    commands.add_parser("artifacts", help="precompute retrieval hints from the vector store")
+    commands.add_parser("list", help="print the lesson index")
+    args = parser.parse_args()
+
+    store = get_lesson_store()
+    if args.command == "seed":
+        if args.path:
+            lessons = load_lesson_file(args.path)
+        else:
+            from lessons import LESSONS as lessons
+        changed = store.put_many(lessons)
+        print(f"{changed} of {len(lessons)} lessons added or updated in {store.url}")
+    elif args.command == "artifacts":
+        from retriever import get_retriever
+
+        print("Loading vector store...")
+        service = get_retriever()
+        db = service.get_store()
+        built = store.build_retrieval_hints(db, service.fingerprint)
+        print(f"Retrieval hints built for {built} lessons")
+    else:
+        for lesson_id, title in store.index():
+            print(f"{lesson_id}\t{title}")
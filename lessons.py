@@ -0,0 +1,96 @@
+LESSONS = {
+    "lesson1": {
+        "title": "الإعراب",
+        "content": """
+            ### الإعراب
+            The Arabic cases are:
+            - الرفع
+                - Primarily used for the subject, predicate, and doer.
+            - النصب
+                - Primarily used for the done-to and after حروف which trigger it's use.
+            - الجر
+                - Primarily used after prepositions.
+
+            Cases in Arabic are applied through case markers at the end of words. They help signify what role a word plays in a sentence.
+        """,
+        "key_points": [
+            "الرفع is primarily used for the subject, predicate, and doer.",
+            "النصب is primarily used for the done-to and after حروف which trigger its use.",
+            "الجر is primarily used after prepositions."
+        ]
+    },
+        "lesson2": {
+        "title": "How to tell status",
+        "content": """
+            ### Determining Status
+            Status is generally determined by the ending sound or combination.
+            
+            - Singular words that end with a ضمة or ضمتان generally are الرفع.
+            - Singular words that end with a كسرة or كسرتان generally are الجر.
+            - Singular words that end with a فتحة or فتحتان generally are النصب. 
+        """,
+        "key_points": [
+            "Singular words that end with a ضمة or ضمتان generally are الرفع.",
+            "Singular words that end with a كسرة or كسرتان generally are الجر.",
+            "Singular words that end with a فتحة or فتحتان generally are النصب."         ]
+    },
+        "lesson3": {
+        "title": "Light vs. Heavy",
+        "content": """
+            ### Understanding Light and Heavy Words
+            Words can either be light or heavy, with heavy being the default.
+            In order to make a word light, simply remove the ن at the end.
+
+            For example:
+            - مسلمٌ <- مسلمُ
+            - مسلمان <- مسلما
+            - مسلمون <- مسلمو
+
+            - Words are never light unless there is a specific reason for them to be.
+        """,
+        "key_points": [
+            "Words are heavy by default",
+            "To make a word light, they ن must be removed."
+            "Words are never light unless there is a specific reason for them to be."
+        ]
+    },
+        "lesson4": {
+        "title": "Flexibility",
+        "content": """
+            ### Flexibility
+            Flexibility is a sub-category of status, and only pertains to words that have an ending sound (as opposed to ending combination).
+            - This means that flexibility only pertains to singular words.
+
+            There are three types of flexibility:
+            - Fully-flexible
+            - Partly-flexible
+            - Non-flexible
+        """,
+        "key_points": [
+                "Flexibility is a sub-category of status",
+                "Flexibility only pertains to singular words",
+                "Words may only be fully-flexible, partly-flexible, or non-flexible."
+        ]
+    },
+        "lesson5": {
+        "title": "Pronouns",
+        "content": """
+            ### Pronouns in Arabic
+            Arabic has 1st person, 2nd person, and 3rd person pronouns. The 1st person pronouns have the singular and plural form, and the 2nd/3rd person pronouns have singular, dual, and plural forms.   
+
+            Pronouns may take three forms:
+            - الضمير المستتر
+                - Pronouns within أفعال.
+            - الضمير المنفصل
+                - Pronouns independently standing by themselves.
+            - الضمير المتصل
+                - Attached pronouns.
+            """,
+        "key_points": [
+                "Arabic has 1st person, 2nd person, and 3rd person pronouns",
+                "The 1st person pronouns have singular and plural forms.",
+                "The 2nd/3rd person pronouns have singular, dual, and plural forms.",
+                "There are three forms that pronouns can take: الضمير المستتر, الضمير المنفصل, الضمير المتصل"
+        ]
+    }
+}
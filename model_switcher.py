@@ -1,14 +1,24 @@
 import os
-import json
-from typing import Dict
+import queue
+import random
+import asyncio
+import threading
+import contextlib
+from typing import AsyncIterator, Dict, Iterator, Union
 
+import httpx
 from pydantic import BaseModel
 from pydantic_ai import Agent
+from pydantic_ai.exceptions import ModelHTTPError
 from pydantic_ai.models.openai import OpenAIModel
 from pydantic_ai.providers.openai import OpenAIProvider
 from pydantic_ai.models.gemini import GeminiModel
 from pydantic_ai.providers.google_gla import GoogleGLAProvider
 
+from structured_output import extract_json, check_output, repair_prompt, parse_partial
+from rate_limit import AsyncRateLimiter
+from telemetry import span, inc, record_tokens
+
 class OutputFormat(BaseModel):
     score: int
     correct_points: list[str]
@@ -18,26 +28,297 @@ class OutputFormat(BaseModel):
     rewritten_answer: str
 
 
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "90"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# One pooled client for both providers so keep-alive connections are reused
+# across requests instead of re-handshaking per evaluation.
+http_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+    limits=httpx.Limits(max_connections=64, max_keepalive_connections=16),
+)
+
 openai_llm = OpenAIModel(
     'gpt-4.1',
-    provider=OpenAIProvider(api_key=os.getenv("OPENAI_API_KEY"))
+    provider=OpenAIProvider(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client)
 )
 
-openaiAgent = Agent(openai_llm, instructions="You are an expert Arabic language tutor.")
+# Native structured output: the model fills OutputFormat directly. A plain
+# text reply is still accepted and goes through the tolerant extractor.
+openaiAgent = Agent(
+    openai_llm,
+    instructions="You are an expert Arabic language tutor.",
+    output_type=Union[OutputFormat, str],
+)
 
 gemini_llm = GeminiModel(
     "gemini-2.5-pro",
-    provider=GoogleGLAProvider(api_key=os.getenv("GEMINI_API_KEY"))
+    provider=GoogleGLAProvider(api_key=os.getenv("GEMINI_API_KEY"), http_client=http_client)
 )
 
-geminiAgent = Agent(gemini_llm, instructions="You are an expert Arabic language tutor.")
+geminiAgent = Agent(
+    gemini_llm,
+    instructions="You are an expert Arabic language tutor.",
+    output_type=Union[OutputFormat, str],
+)
+
+AGENTS = {"Gemini": geminiAgent, "OpenAI": openaiAgent}
+# Plain-text agents: used for token streaming and to re-ask for just the
+# fields that failed to parse.
+TEXT_AGENTS = {
+    "Gemini": Agent(gemini_llm, instructions="You are an expert Arabic language tutor."),
+    "OpenAI": Agent(openai_llm, instructions="You are an expert Arabic language tutor."),
+}
+PARSE_REPAIR_RETRIES = int(os.getenv("PARSE_REPAIR_RETRIES", "1"))
+RACE = "Race"
+
+_semaphores: Dict[str, asyncio.Semaphore] = {}
+_usage: Dict[str, Dict[str, int]] = {}
+_usage_lock = threading.Lock()
+parse_counters = {"native": 0, "extracted": 0, "repaired": 0, "failed": 0}
+
+
+def _semaphore(provider: str) -> asyncio.Semaphore:
+    if provider not in _semaphores:
+        _semaphores[provider] = asyncio.Semaphore(LLM_MAX_IN_FLIGHT)
+    return _semaphores[provider]
+
+
+def _record_usage(provider: str, response):
+    usage = response.usage()
+    input_tokens = getattr(usage, "input_tokens", None) or getattr(usage, "request_tokens", None) or 0
+    output_tokens = getattr(usage, "output_tokens", None) or getattr(usage, "response_tokens", None) or 0
+    with _usage_lock:
+        totals = _usage.setdefault(provider, {"requests": 0, "input_tokens": 0, "output_tokens": 0})
+        totals["requests"] += 1
+        totals["input_tokens"] += input_tokens
+        totals["output_tokens"] += output_tokens
+    record_tokens(provider, input_tokens, output_tokens)
+
+
+def token_usage() -> Dict[str, Dict[str, int]]:
+    with _usage_lock:
+        return {provider: dict(totals) for provider, totals in _usage.items()}
+
+
+class OutputParseError(ValueError):
+    pass
+
+
+def parse_stats() -> Dict[str, int]:
+    return dict(parse_counters)
+
+
+async def _parse_response(provider: str, response, timeout: float,
+                          rate_limiter: AsyncRateLimiter | None = None) -> dict:
+    output = response.output
+    if isinstance(output, OutputFormat):
+        parse_counters["native"] += 1
+        inc("llm_parse_total", outcome="native")
+        return output.model_dump()
+    return await _parse_text(provider, output, response.all_messages(), timeout, rate_limiter)
+
+
+async def _parse_text(provider: str, output: str, history: list, timeout: float,
+                      rate_limiter: AsyncRateLimiter | None = None) -> dict:
+    data = extract_json(output) or {}
+    result, invalid = check_output(data, OutputFormat)
+    if result is not None:
+        parse_counters["extracted"] += 1
+        inc("llm_parse_total", outcome="extracted")
+        return result
+
+    # Re-ask only for the broken fields, continuing the same conversation so
+    # the model doesn't regenerate the whole evaluation.
+    for _ in range(PARSE_REPAIR_RETRIES):
+        if rate_limiter is not None:
+            await rate_limiter.acquire()
+        repair = await asyncio.wait_for(
+            TEXT_AGENTS[provider].run(repair_prompt(invalid, OutputFormat), message_history=history), timeout
+        )
+        _record_usage(provider, repair)
+        patch = extract_json(repair.output) or {}
+        data.update({field: patch[field] for field in invalid if field in patch})
+        result, invalid = check_output(data, OutputFormat)
+        if result is not None:
+            parse_counters["repaired"] += 1
+            inc("llm_parse_total", outcome="repaired")
+            return result
+        history = repair.all_messages()
+
+    parse_counters["failed"] += 1
+    inc("llm_parse_total", outcome="failed")
+    raise OutputParseError(f"{provider} output could not be parsed; invalid fields: {', '.join(invalid)}")
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, ModelHTTPError):
+        return error.status_code in RETRYABLE_STATUS
+    return isinstance(error, (asyncio.TimeoutError, httpx.TimeoutException, httpx.TransportError))
+
+
+async def _run_agent(provider: str, prompt: str, timeout: float, max_retries: int,
+                     rate_limiter: AsyncRateLimiter | None = None) -> dict:
+    # rate_limiter, when given, is acquired once per request actually sent:
+    # every attempt and every repair call.
+    agent = AGENTS[provider]
+    attempt = 0
+    while True:
+        try:
+            if rate_limiter is not None:
+                await rate_limiter.acquire()
+            async with _semaphore(provider):
+                with span("llm.call", provider=provider):
+                    response = await asyncio.wait_for(agent.run(user_prompt=prompt), timeout)
+            _record_usage(provider, response)
+            with span("llm.parse", provider=provider):
+                return await _parse_response(provider, response, timeout, rate_limiter)
+        except Exception as e:
+            if attempt >= max_retries or not _is_retryable(e):
+                raise
+            inc("llm_retries_total", provider=provider, type=type(e).__name__)
+            # Exponential backoff with full jitter: 1s, 2s, 4s... capped at 20s.
+            delay = random.uniform(0, min(20.0, 2 ** attempt))
+            print(f"{provider} call failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+async def _race(prompt: str, timeout: float, max_retries: int, rate_limiter: AsyncRateLimiter | None = None) -> dict:
+    # Send the prompt to every provider and keep the first valid OutputFormat.
+    tasks = [
+        asyncio.create_task(_run_agent(provider, prompt, timeout, max_retries, rate_limiter)) for provider in AGENTS
+    ]
+    last_error = None
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                return await next_done
+            except Exception as e:
+                last_error = e
+        raise last_error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def evaluate_async(prompt: str, model_choice: str, timeout: float = LLM_TIMEOUT,
+                         max_retries: int = LLM_MAX_RETRIES, rate_limiter: AsyncRateLimiter | None = None) -> dict:
+    if model_choice == RACE:
+        return await _race(prompt, timeout, max_retries, rate_limiter)
+    if model_choice not in AGENTS:
+        raise ValueError(f"Unknown model choice: {model_choice}")
+    return await _run_agent(model_choice, prompt, timeout, max_retries, rate_limiter)
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    # Sync callers (Streamlit script threads) share one long-lived event loop
+    # so the pooled HTTP client and semaphores stay bound to a single loop.
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-event-loop", daemon=True).start()
+        return _loop
 
 
 def evaluate(prompt: str, model_choice: str) -> dict:
-    if model_choice == "Gemini":
-        response = geminiAgent.run_sync(user_prompt=prompt)
-    elif model_choice == "OpenAI":
-        response = openaiAgent.run_sync(user_prompt=prompt)
-    
-    print(((response.output).strip("```")).strip("json"))
-    return json.loads(((response.output).strip("```")).strip("json"))
+    future = asyncio.run_coroutine_threadsafe(evaluate_async(prompt, model_choice), _background_loop())
+    return future.result()
+
+
+async def evaluate_stream_async(prompt: str, model_choice: str, timeout: float = LLM_TIMEOUT,
+                                max_retries: int = LLM_MAX_RETRIES) -> AsyncIterator[tuple[dict, bool]]:
+    # Yields (partial, False) as fields finish arriving, then (result, True)
+    # with the validated OutputFormat dict. Partials only contain completed
+    # values: whole strings/numbers and the finished items of each list.
+    # Streams the plain-text agent: with native structured output the object
+    # only validates once complete, so there would be nothing to show early.
+    if model_choice not in TEXT_AGENTS:
+        # Racing has no single stream to follow; deliver the final result.
+        yield await evaluate_async(prompt, model_choice, timeout, max_retries), True
+        return
+    provider = model_choice
+    loop = asyncio.get_running_loop()
+    # One deadline for the whole stream, retries included, so a stalled
+    # provider can't hold the page (or an API slot) open indefinitely.
+    deadline = loop.time() + timeout
+
+    def remaining() -> float:
+        return max(0.0, deadline - loop.time())
+
+    last_seen = None
+    attempt = 0
+    while True:
+        try:
+            async with _semaphore(provider), contextlib.AsyncExitStack() as stack:
+                stack.enter_context(span("llm.stream", provider=provider))
+                # Each await gets the shared deadline in this task (wait_for
+                # would move it to another task, and pydantic-ai's context
+                # variables with it); a yield is never inside the timeout.
+                async with asyncio.timeout_at(deadline):
+                    result = await stack.enter_async_context(TEXT_AGENTS[provider].run_stream(user_prompt=prompt))
+                texts = result.stream_text(debounce_by=0.05).__aiter__()
+                while True:
+                    try:
+                        async with asyncio.timeout_at(deadline):
+                            text = await texts.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    partial, _ = parse_partial(text)
+                    if partial and partial != last_seen:
+                        last_seen = partial
+                        yield partial, False
+                async with asyncio.timeout_at(deadline):
+                    output = await result.get_output()
+                _record_usage(provider, result)
+                history = result.all_messages()
+            break
+        except Exception as e:
+            # After the first partial a retry would restart feedback the user
+            # is already reading, so only failures before it are retried.
+            if last_seen is not None or attempt >= max_retries or not _is_retryable(e) or remaining() == 0:
+                raise
+            inc("llm_retries_total", provider=provider, type=type(e).__name__)
+            # Same backoff as _run_agent, but never past the deadline.
+            delay = min(random.uniform(0, min(20.0, 2 ** attempt)), remaining())
+            print(f"{provider} stream failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            attempt += 1
+            await asyncio.sleep(delay)
+    with span("llm.parse", provider=provider):
+        result = await _parse_text(provider, output, history, remaining())
+    yield result, True
+
+
+def evaluate_stream(prompt: str, model_choice: str) -> Iterator[tuple[dict, bool]]:
+    # Sync bridge for Streamlit: drives evaluate_stream_async on the shared
+    # background loop and hands items over through a queue.
+    items = queue.Queue()
+
+    async def pump():
+        try:
+            async for item in evaluate_stream_async(prompt, model_choice):
+                items.put(("item", item))
+        except Exception as e:
+            items.put(("error", e))
+        finally:
+            items.put(("done", None))
+
+    future = asyncio.run_coroutine_threadsafe(pump(), _background_loop())
+    try:
+        while True:
+            kind, value = items.get()
+            if kind == "item":
+                yield value
+            elif kind == "error":
+                raise value
+            else:
+                return
+    finally:
+        future.cancel()
@@ -0,0 +1,109 @@
+import os
+import hmac
+import time
+from collections import defaultdict
+
+import streamlit as st
+from dotenv import load_dotenv
+
+from telemetry import registry, TELEMETRY_ENABLED
+
+load_dotenv()
+
+ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
+
+st.set_page_config(page_title="Evaluation Metrics", layout="wide")
+st.title("Evaluation Metrics")
+
+# Deny by default: this page is listed in every student's sidebar, so
+# without a configured password it shows nothing.
+if not ADMIN_PASSWORD:
+    st.info("This page is disabled. Set ADMIN_PASSWORD to enable it.")
+    st.stop()
+entered = st.text_input("Admin password", type="password")
+if not hmac.compare_digest(entered.encode(), ADMIN_PASSWORD.encode()):
+    if entered:
+        st.error("Wrong password.")
+    st.stop()
+
+if not TELEMETRY_ENABLED:
+    st.warning("Telemetry is disabled (TELEMETRY=0); nothing is being recorded.")
+    st.stop()
+
+st.caption(f"This process, since {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(registry.started))}. "
+           f"Percentiles cover the most recent observations of each stage.")
+
+counters = registry.counter_rows()
+
+st.subheader("Stage latency")
+stages = registry.percentiles()
+if stages:
+    st.dataframe(stages, use_container_width=True, hide_index=True)
+else:
+    st.info("No evaluations recorded yet.")
+
+left, right = st.columns(2)
+
+with left:
+    st.subheader("LLM usage")
+    usage = defaultdict(lambda: {"requests": 0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0})
+    for row in counters:
+        if row["metric"] == "llm_requests_total":
+            usage[row["provider"]]["requests"] = int(row["value"])
+        elif row["metric"] == "llm_tokens_total":
+            usage[row["provider"]][f"{row['direction']}_tokens"] = int(row["value"])
+        elif row["metric"] == "llm_cost_usd_total":
+            usage[row["provider"]]["cost_usd"] = round(row["value"], 4)
+    if usage:
+        st.dataframe([{"provider": provider, **totals} for provider, totals in usage.items()],
+                     use_container_width=True, hide_index=True)
+    else:
+        st.info("No LLM calls yet.")
+
+    st.subheader("Parse outcomes")
+    parses = [{"outcome": row["outcome"], "count": int(row["value"])} for row in counters if row["metric"] == "llm_parse_total"]
+    if parses:
+        st.dataframe(parses, use_container_width=True, hide_index=True)
+
+with right:
+    st.subheader("Caches")
+    caches = defaultdict(dict)
+    for row in counters:
+        if row["metric"] == "cache_requests_total":
+            caches[row["cache"]][row["result"]] = int(row["value"])
+    if caches:
+        rows = []
+        for cache, results in caches.items():
+            total = sum(results.values())
+            misses = results.get("miss", 0)
+            rows.append({"cache": cache, **results, "hit_rate": round((total - misses) / total, 3) if total else 0.0})
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+    else:
+        st.info("No cache lookups yet.")
+
+    st.subheader("Errors")
+    errors = [{"stage": row["stage"], "type": row["type"], "count": int(row["value"])}
+              for row in counters if row["metric"] == "errors_total"]
+    retries = [{"provider": row["provider"], "type": row["type"], "retries": int(row["value"])}
+               for row in counters if row["metric"] == "llm_retries_total"]
+    if errors or retries:
+        if errors:
+            st.dataframe(errors, use_container_width=True, hide_index=True)
+        if retries:
+            st.dataframe(retries, use_container_width=True, hide_index=True)
+    else:
+        st.success("No errors recorded.")
+
+with st.expander("Prometheus exposition"):
+    st.code(registry.render_prometheus(), language="text")
+
+controls = st.columns(3)
+auto_refresh = controls[0].checkbox("Auto-refresh", value=False)
+interval = controls[1].number_input("Every (seconds)", min_value=1, max_value=60, value=5)
+if controls[2].button("Reset metrics"):
+    registry.reset()
+    st.rerun()
+
+if auto_refresh:
+    time.sleep(interval)
+    st.rerun()
@@ -0,0 +1,127 @@
+import os
+import re
+
+import numpy as np
+from dotenv import load_dotenv
+
+from hybrid_retriever import tokenize
+from telemetry import span, inc
+
+load_dotenv()
+
+PRESCORE_ENABLED = os.getenv("PRESCORE", "1") != "0"
+# Coverage hints need an embedding call per answer. That is a remote round
+# trip with the OpenAI backend, so they are opt-in there and on by default
+# only with the local model; blank answers are handled either way.
+_LOCAL_EMBEDDINGS = os.getenv("EMBEDDING_BACKEND", "openai").lower() == "local"
+PRESCORE_EMBEDDINGS = os.getenv("PRESCORE_EMBEDDINGS", "1" if _LOCAL_EMBEDDINGS else "0") != "0"
+# Cosine similarity between an answer sentence and a key point. Model
+# dependent: the defaults suit OpenAI text-embedding-3 / MiniLM.
+PRESCORE_SIM_HIGH = float(os.getenv("PRESCORE_SIM_HIGH", "0.80"))
+PRESCORE_SIM_LOW = float(os.getenv("PRESCORE_SIM_LOW", "0.45"))
+# Fraction of a key point's content words found in the answer.
+PRESCORE_LEX_HIGH = float(os.getenv("PRESCORE_LEX_HIGH", "0.75"))
+PRESCORE_LEX_LOW = float(os.getenv("PRESCORE_LEX_LOW", "0.2"))
+
+_SENTENCE_RE = re.compile(r"[^.!?؟\n،؛;]+")
+_STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "be", "of", "to", "in", "on", "for", "and", "or", "with", "that",
+    "this", "it", "its", "as", "by", "at", "which", "there", "their", "they", "them", "has", "have", "can",
+    "do", "does", "not", "if", "but", "so", "then", "from", "into", "all", "some", "each", "these", "those",
+    "generally", "primarily", "mainly", "usually", "also", "used", "use", "only", "would", "will",
+    "في", "من", "على", "الى", "عن", "و", "او", "ان", "هو", "هي",
+}
+_SUFFIXES = ("ing", "ed", "es", "s", "ly")
+
+
+def _stem(token: str) -> str:
+    # Latin only; Arabic tokens are already normalized by tokenize().
+    if not token.isascii():
+        return token
+    for suffix in _SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)]
+    return token
+
+
+def content_tokens(text: str) -> set[str]:
+    return {_stem(token) for token in tokenize(text) if token not in _STOPWORDS}
+
+
+def split_sentences(text: str) -> list[str]:
+    return [sentence.strip(" -*•\t") for sentence in _SENTENCE_RE.findall(text) if sentence.strip(" -*•\t")]
+
+
+def lexical_coverage(answer_tokens: set[str], key_points: list[str]) -> np.ndarray:
+    coverage = np.zeros(len(key_points), dtype=np.float32)
+    for i, key_point in enumerate(key_points):
+        tokens = content_tokens(key_point)
+        if tokens:
+            coverage[i] = len(tokens & answer_tokens) / len(tokens)
+    return coverage
+
+
+def semantic_similarity(sentences: list[str], key_point_vectors: np.ndarray, embeddings) -> np.ndarray:
+    # Best cosine similarity of any answer sentence to each key point.
+    vectors = np.asarray(embeddings.embed_documents(sentences), dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+    return (vectors @ key_point_vectors.T).max(axis=0)
+
+
+class Prescore:
+    # Hints only: covered/missed are guesses from similarity and word overlap,
+    # which can't tell a correct statement from a swapped or negated one. The
+    # LLM still judges every key point.
+
+    def __init__(self, covered: list[str], missed: list[str]):
+        self.covered = covered
+        self.missed = missed
+
+
+def blank_result(user_response: str, lesson: dict) -> dict | None:
+    # The one case decided without the LLM: an answer with no content words.
+    if not PRESCORE_ENABLED or content_tokens(user_response):
+        return None
+    inc("prescore_total", outcome="blank")
+    key_points = list(lesson["key_points"])
+    return {
+        "score": 0,
+        "correct_points": [],
+        "incorrect_points": [],
+        "missed_points": key_points,
+        "generated_feedback": "It looks like this lesson hasn't stuck yet, and that's completely normal. "
+                              "Read through it once more, then try writing each main point in your own words.",
+        "rewritten_answer": " ".join(key_points),
+    }
+
+
+def prescore_answer(user_response: str, lesson: dict, lesson_id: str | None = None,
+                    embeddings=None) -> Prescore | None:
+    # None means no hints: the answer goes to the LLM exactly as without
+    # pre-scoring.
+    key_points = list(lesson["key_points"])
+    if not PRESCORE_ENABLED or not PRESCORE_EMBEDDINGS or not key_points or lesson_id is None:
+        return None
+    with span("prescore"):
+        try:
+            from embedding_cache import get_embeddings
+            from lesson_store import get_lesson_store
+
+            embeddings = embeddings or get_embeddings()
+            key_point_vectors = get_lesson_store().key_point_embeddings(lesson_id, lesson, embeddings)
+            similarity = semantic_similarity(split_sentences(user_response) or [user_response],
+                                             key_point_vectors, embeddings)
+        except Exception as e:
+            print(f"Pre-scoring skipped: {e}")
+            inc("prescore_total", outcome="error")
+            return None
+
+        lexical = lexical_coverage(content_tokens(user_response), key_points)
+        covered_mask = (similarity >= PRESCORE_SIM_HIGH) | ((lexical >= PRESCORE_LEX_HIGH) & (similarity >= PRESCORE_SIM_LOW))
+        missed_mask = (similarity < PRESCORE_SIM_LOW) & (lexical < PRESCORE_LEX_LOW)
+        inc("prescore_total", outcome="hints")
+        return Prescore(
+            [point for point, flag in zip(key_points, covered_mask) if flag],
+            [point for point, flag in zip(key_points, missed_mask) if flag],
+        )
@@ -1,7 +1,37 @@
-def build_rag_prompt(user_response: str, retrieved_text: str, key_points: list[str]) -> str:
-    key_points_text = "\n".join(f"- {pt}" for pt in key_points)
+import os
+import re
+
+# Bump whenever the template text changes so cached evaluations and logged
+# examples from older templates can be told apart.
+PROMPT_VERSION = "rag-v3"
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2500"))
+# Chunks sharing more than this fraction of their word trigrams with an
+# already-selected chunk are dropped as duplicates.
+CHUNK_OVERLAP_THRESHOLD = 0.5
+CHUNK_SEPARATOR = "\n---\n"
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+try:
+    import tiktoken
 
-    return f"""
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:  # tiktoken missing or its encoding files unavailable offline
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # Rough fallback: ~4 bytes per token (Arabic script is 2 bytes per letter,
+    # so it counts heavier, as it does with real tokenizers).
+    return (len(text.encode("utf-8")) + 3) // 4
+
+
+# Everything up to the context is identical on every call, so providers that
+# cache prompt prefixes (OpenAI, Gemini) can reuse it.
+STATIC_PREFIX = f"""[template {PROMPT_VERSION}]
 You are an Arabic language tutor.
 
 Instructions:
@@ -11,7 +41,28 @@ Instructions:
 - Rewrite the student's answer to be more complete and accurate.
 - By default, use the provided external context to answer the User Query, never use your own knowledge to answer the query.
 
+# Example:
+Relevant retrieved text:
+Nominative: The subject of a verbal sentence is usually in the nominative case. For example, "الولد يدرس" (al-walad yadrus - The boy studies).
+Accusative: The direct object of a verb is in the accusative case. For example, "أنا أقرأ الكتاب" (Ana a'qra' al-kitab - I read the book).
+Genitive: The genitive case is used after prepositions, when indicating ownership, or in idhaafa.
 
+Key Points:
+- الرفع is primarily used for the subject, predicate, and doer.
+- النصب is primarily used for the done-to and after حروف which trigger its use.
+- الجر is primarily used after prepositions.
+
+User recall:
+Arabic has three cases. One of the cases is رفع, another is جر, and finally we have نصب. Raf' is used for subjects, jarr is used for prepositions, and nasb is used for the done-to. These cases help us understand the role of certain words in Arabic
+
+Your response:
+{{"score": 70, "correct_points": ["الرفع is primarily used for the subject", "النصب is primarily used for the done-to"], "incorrect_points": ["You incorrectly stated that الجر is used for prepositions. The correct usage of الجر is after prepositions"], "missed_points": ["You didn't mention that النصب is used after حروف which trigger its use", "You didn't mention that الرفع is used for the predicate and doer"], "generated_feedback": "You have a solid idea of how cases work in Arabic. Focus on the specific details of when each case is used: go through the lesson once more, then try recalling everything a second time. Good luck!", "rewritten_answer": "Arabic has three cases: رفع, نصب and جر. Raf' is used for the subject, predicate, and doer; nasb is used for the done-to and after حروف which trigger its use; jarr is used after prepositions. These cases help us understand the role of words in Arabic."}}
+
+Respond in this JSON format:
+{{"score": <number>, "correct_points": [...], "incorrect_points": [...], "missed_points": [...], "generated_feedback": "...", "rewritten_answer": "..."}}
+"""
+
+_DYNAMIC_TEMPLATE = """
 Here is the relevant content retrieved from the textbook
 <<<
 {retrieved_text}
@@ -19,55 +70,82 @@ Here is the relevant content retrieved from the textbook
 
 And here are the key points the student should recall:
 {key_points_text}
-
+{hints_text}
 The student wrote:
 \"\"\"{user_response}\"\"\"
+"""
 
-Instructions:
-- Identify what the student got right, wrong, and left out.
-- Give a score out of 100.
-- Provide a brief feedback paragraph.
-- Rewrite the student's answer to be more complete and accurate.
-- By default, use the provided external context to answer the User Query, never use your own knowledge to answer the query.
 
-# Examples:
-Example 1: [
-Relevant retrieved text:
-            Nominative:
-            The subject of a verbal sentence is usually in the nominative case. For example, "الولد يدرس" (al-walad yadrus - The boy studies). 
-            Accusative:
-            The direct object of a verb is in the accusative case. For example, "أنا أقرأ الكتاب" (Ana a'qra' al-kitab - I read the book). 
-            Genitive:
-            The genitive case is used in several contexts, including after prepositions, when indicating ownership, or when the noun is used with a second noun in a descriptive context (known as idhaafa). 
+def _trigrams(text: str) -> set[tuple[str, ...]]:
+    words = [word.lower() for word in _WORD_RE.findall(text)]
+    if len(words) < 3:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + 3]) for i in range(len(words) - 2)}
 
-Key Points:
-            "الرفع is primarily used for the subject, predicate, and doer.",
-            "النصب is primarily used for the done-to and after حروف which trigger its use.",
-            "الجر is primarily used after prepositions."
 
-User recall:
-            Arabic has three cases. One of the cases is رفع, another is جر, and finally we have نصب. Raf' is used for subjects, jarr is used for prepositions, and nasb is used for the done-to. 
-            These cases help us understand the role of certain words in Arabic
+def _overlap(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
 
-Your response:
-            {{
-                "score": 70,
-                "correct_points": ["الرفع is primarily used for the subject", "النصب is primarily used for the done-to"],
-                "incorrect_points": ["You incorrectly stated that الجر is used for prepositions. The correct usage of الجر is after prepositions"],
-                "missed_points": ["You didn't mention that النصب is used after حروف which trigger its use", "You didn't mention that الرفع is used for the predicate and doer"],
-                "generate_feedback": "You have a solid idea of how cases work in Arabic. You primarily need to focus on the specific details of when the cases are used. I would suggest that you through the lesson once more and focus on the finer details, then try recalling everything you remember a second time. Good luck!",
-                "rewritten_answer": "Arabic has three cases. One of the cases is رفع, another is جر, and finally we have نصب.  Raf' is used for the subject, predicate, and done-to; jarr is used after prepositions; nasb is used for the done-to and after حروف which trigger its use. 
-                                     These cases help us understand the role of certain words in Arabic"
-            }}
-]
-
-Response in this JSON format :
-{{
-    "score": <number>,
-    "correct_points": [...],
-    "incorrect_points": [...],
-    "missed_points": [...],
-    "generated_feedback": "...",
-    "rewritten_answer": "..."
-}}
-"""
\ No newline at end of file
+
+def select_chunks(chunks: list[str], key_points: list[str], token_budget: int) -> list[str]:
+    # Near-duplicate chunks are dropped, the rest ranked by how many key-point
+    # words they contain (retrieval order breaks ties) and packed into the
+    # budget. Selected chunks keep their retrieval order in the prompt.
+    key_words = {word.lower() for point in key_points for word in _WORD_RE.findall(point)}
+    kept = []
+    for position, chunk in enumerate(chunks):
+        shingles = _trigrams(chunk)
+        if any(_overlap(shingles, other) > CHUNK_OVERLAP_THRESHOLD for _, _, other in kept):
+            continue
+        kept.append((position, chunk, shingles))
+
+    def relevance(item):
+        position, chunk, _ = item
+        words = {word.lower() for word in _WORD_RE.findall(chunk)}
+        return (-len(words & key_words), position)
+
+    selected = []
+    used = 0
+    for position, chunk, _ in sorted(kept, key=relevance):
+        cost = count_tokens(chunk + CHUNK_SEPARATOR)
+        if used + cost > token_budget:
+            continue
+        selected.append((position, chunk))
+        used += cost
+    return [chunk for _, chunk in sorted(selected)]
+
+
+def _hints_text(likely_covered: list[str], likely_missed: list[str]) -> str:
+    if not likely_covered and not likely_missed:
+        return ""
+    lines = ["\nAn automatic similarity check (not a grade; it can't tell a correct statement from a wrong or "
+             "negated one, so judge every key point yourself) suggests:"]
+    if likely_covered:
+        lines.append("Probably mentioned: " + "; ".join(likely_covered))
+    if likely_missed:
+        lines.append("Probably not mentioned: " + "; ".join(likely_missed))
+    return "\n".join(lines) + "\n"
+
+
+def build_rag_prompt(user_response: str, retrieved_text: str, key_points: list[str],
+                     token_budget: int = PROMPT_TOKEN_BUDGET, likely_covered: list[str] | None = None,
+                     likely_missed: list[str] | None = None) -> str:
+    key_points_text = "\n".join(f"- {pt}" for pt in key_points)
+    hints_text = _hints_text(likely_covered or [], likely_missed or [])
+
+    fixed = STATIC_PREFIX + _DYNAMIC_TEMPLATE.format(
+        retrieved_text="", key_points_text=key_points_text, hints_text=hints_text, user_response=user_response
+    )
+    chunks = [chunk.strip() for chunk in retrieved_text.split(CHUNK_SEPARATOR) if chunk.strip()]
+    context_budget = max(0, token_budget - count_tokens(fixed))
+    # Points the answer already seems to cover need less supporting context:
+    # rank chunks by the rest and shrink the budget, down to half.
+    focus = [point for point in key_points if point not in (likely_covered or [])] or key_points
+    context_budget = int(context_budget * max(0.5, len(focus) / max(1, len(key_points))))
+    context = CHUNK_SEPARATOR.join(select_chunks(chunks, focus, context_budget))
+
+    return STATIC_PREFIX + _DYNAMIC_TEMPLATE.format(
+        retrieved_text=context, key_points_text=key_points_text, hints_text=hints_text, user_response=user_response
+    )
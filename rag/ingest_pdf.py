@@ -1,33 +1,276 @@
 import fitz #PyMuPDF
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
 import os
+import re
+import sys
+import json
+import math
+import shutil
+import hashlib
+import argparse
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterable, Iterator
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embedding_cache import get_embeddings
+from vector_index import (
+    DOCSTORE_NAME, INDEX_TYPES, QUANTIZATIONS, SQLiteDocstore, build_index, current_store_dir, format_report,
+    load_vectors, new_store_version, recall_report, save_store,
+)
+
 load_dotenv()
 
 PDF_PATH = "./Dream_Textbook.pdf"
 VECTOR_PATH = "./vector_store"
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 2
+
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+EMBED_BATCH_SIZE = 64
+EMBED_CONCURRENCY = 4
+INDEX_BATCH_SIZE = 512
+
+# "Lesson 12", "Chapter 3", "Unit 2" or numbered headings like "4.2" at the
+# start of a line.
+SECTION_RE = re.compile(r"^\s*((?:lesson|chapter|unit)\s+\d+|\d+(?:\.\d+)+)\b", re.IGNORECASE | re.MULTILINE)
+
+
+def _batched(items: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _extract_range(path, start, stop):
+    with fitz.open(path) as doc:
+        return [(number + 1, doc[number].get_text()) for number in range(start, stop)]
+
+
+def extract_pages(path, workers=None) -> Iterator[tuple[int, str]]:
+    # Pages are extracted in page ranges across a process pool and yielded in
+    # order as (page_number, text), so nothing holds the whole book at once.
+    with fitz.open(path) as doc:
+        page_count = doc.page_count
+    if page_count == 0:
+        return
+    workers = workers or os.cpu_count() or 1
+    step = max(1, math.ceil(page_count / (workers * 4)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = deque(
+            pool.submit(_extract_range, path, start, min(start + step, page_count))
+            for start in range(0, page_count, step)
+        )
+        while futures:
+            yield from futures.popleft().result()
+
 
 def extract_text_from_pdf(path):
-    doc = fitz.open(path)
-    full_text = ""
-    for page in doc: 
-        full_text += page.get_text()
-    return full_text
+    return "".join(text for _, text in extract_pages(path))
+
+
+def chunk_id(text: str, page: int, section: str | None) -> str:
+    return hashlib.sha256(f"{page}\x00{section or ''}\x00{text}".encode("utf-8")).hexdigest()
+
+
+def split_pages(pages: Iterable[tuple[int, str]], chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP) -> Iterator[Document]:
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    section = None
+    for page_number, text in pages:
+        headings = [(match.start(), match.group(1).strip()) for match in SECTION_RE.finditer(text)]
+        cursor = 0
+        for chunk in splitter.split_text(text):
+            position = text.find(chunk, cursor)
+            if position == -1:
+                position = cursor
+            else:
+                cursor = position + 1
+            # The section a chunk belongs to is the last heading at or before
+            # its start, carried over from earlier pages.
+            while headings and headings[0][0] <= position:
+                section = headings.pop(0)[1]
+            yield Document(
+                page_content=chunk,
+                metadata={
+                    "page": page_number,
+                    "section": section,
+                    "chunk_id": chunk_id(chunk, page_number, section),
+                },
+            )
+
+
+def embed_batches(docs: Iterable[Document], embeddings, batch_size=EMBED_BATCH_SIZE, concurrency=EMBED_CONCURRENCY):
+    # At most `concurrency` embedding requests are in flight; results come back
+    # in input order as (documents, vectors).
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = deque()
+        for batch in _batched(docs, batch_size):
+            pending.append((batch, pool.submit(embeddings.embed_documents, [doc.page_content for doc in batch])))
+            if len(pending) >= concurrency:
+                batch, future = pending.popleft()
+                yield batch, future.result()
+        while pending:
+            batch, future = pending.popleft()
+            yield batch, future.result()
+
+
+def index_batches(embedded, batch_size=INDEX_BATCH_SIZE):
+    # Regroup embedding batches into larger batches for index insertion.
+    docs, vectors = [], []
+    for batch_docs, batch_vectors in embedded:
+        docs.extend(batch_docs)
+        vectors.extend(batch_vectors)
+        if len(docs) >= batch_size:
+            yield docs, vectors
+            docs, vectors = [], []
+    if docs:
+        yield docs, vectors
 
-def create_vector_store(text):
-    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap =50)
-    chunks = splitter.split_text(text)
 
-    embeddings = OpenAIEmbeddings()
-    db = FAISS.from_texts(chunks, embeddings)
-    db.save_local(VECTOR_PATH)
-    print(f"Vector store saved to {VECTOR_PATH}")
+def load_manifest(vector_path=VECTOR_PATH) -> dict | None:
+    path = os.path.join(vector_path, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(manifest: dict, vector_path=VECTOR_PATH):
+    path = os.path.join(vector_path, MANIFEST_NAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def previous_vectors(vector_path: str, manifest: dict | None, model_name: str) -> dict[str, np.ndarray]:
+    # chunk_id -> vector from the live store, for chunks the manifest says it
+    # holds. Only usable when it was built with the same embedding model and
+    # stores vectors losslessly.
+    if not manifest or manifest.get("embedding_model") != model_name or manifest.get("quantization") != "none":
+        return {}
+    store_dir = current_store_dir(vector_path)
+    if store_dir is None:
+        return {}
+    try:
+        ids, vectors = load_vectors(store_dir)
+    except Exception as e:
+        print(f"Can't reuse vectors from the previous build ({e}); re-embedding")
+        return {}
+    return {cid: vector for cid, vector in zip(ids, vectors) if cid in manifest["chunks"]}
+
+
+def create_vector_store(docs: Iterable[Document], vector_path=VECTOR_PATH, full=False,
+                        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                        index_type="flat", quantization="none", report=False):
+    # Chunks listed in the manifest keep their vectors from the previous
+    # build; only new chunks are embedded (through the embedding cache, so a
+    # --full rebuild of unchanged text is still cheap while it stays cached).
+    # The index is rebuilt from all vectors, which works for every index type
+    # (HNSW can't delete, IVF/PQ need retraining as the corpus grows).
+    embeddings = get_embeddings()
+    manifest = None if full else load_manifest(vector_path)
+    if manifest and (manifest["chunk_size"], manifest["chunk_overlap"]) != (chunk_size, chunk_overlap):
+        manifest = None
+    known = manifest["chunks"] if manifest else {}
+    reusable = previous_vectors(vector_path, manifest, embeddings.model_name)
+
+    # Built in a fresh version directory the running app doesn't look at.
+    version_dir = new_store_version(vector_path)
+    docstore = SQLiteDocstore(os.path.join(version_dir, DOCSTORE_NAME), read_only=False)
+
+    seen = {}
+    reused = []
+
+    def new_docs():
+        for doc in docs:
+            cid = doc.metadata["chunk_id"]
+            if cid in seen:
+                continue
+            seen[cid] = {"page": doc.metadata["page"], "section": doc.metadata["section"]}
+            if cid in reusable:
+                reused.append(doc)
+                continue
+            yield doc
+
+    vectors = []
+    count = 0
+
+    def add(batch_docs, batch_vectors):
+        nonlocal count
+        docstore.add_documents(count, [doc.metadata["chunk_id"] for doc in batch_docs], batch_docs)
+        vectors.append(np.asarray(batch_vectors, dtype=np.float32))
+        count += len(batch_docs)
+
+    for batch_docs, batch_vectors in index_batches(embed_batches(new_docs(), embeddings)):
+        add(batch_docs, batch_vectors)
+        print(f"Embedded {count} chunks")
+    if reused:
+        add(reused, [reusable[doc.metadata["chunk_id"]] for doc in reused])
+        print(f"Reused {len(reused)} unchanged chunks from the previous build")
+    docstore.close()
+
+    if not count:
+        shutil.rmtree(version_dir)
+        print("No chunks to index")
+        return None
+
+    matrix = np.vstack(vectors)
+    if report:
+        options = [(kind, codec) for kind in INDEX_TYPES for codec in QUANTIZATIONS]
+        print(format_report(recall_report(matrix, options)))
+    index = build_index(matrix, index_type, quantization)
+    save_store(vector_path, index, version_dir)
+
+    added = sum(1 for cid in seen if cid not in known)
+    removed = sum(1 for cid in known if cid not in seen)
+    save_manifest(
+        {
+            "version": MANIFEST_VERSION,
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "index_type": index_type,
+            "quantization": quantization,
+            "embedding_model": embeddings.model_name,
+            "chunks": seen,
+        },
+        vector_path,
+    )
+    print(f"Vector store saved to {vector_path} ({added} new, {removed} removed, {count} total, {index_type}/{quantization})")
+    print(f"Embedding cache: {embeddings.stats}")
+    return index
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embed the textbook PDF into the FAISS vector store.")
+    parser.add_argument("--pdf", default=PDF_PATH)
+    parser.add_argument("--out", default=VECTOR_PATH)
+    parser.add_argument("--workers", type=int, default=None, help="processes used for PDF extraction")
+    parser.add_argument("--full", action="store_true", help="ignore the manifest and re-embed every chunk")
+    parser.add_argument("--index", choices=INDEX_TYPES, default="flat", help="FAISS index structure")
+    parser.add_argument("--quantization", choices=QUANTIZATIONS, default="none", help="vector compression")
+    parser.add_argument("--report", action="store_true",
+                        help="print recall@10 vs latency for every index/quantization option before saving")
+    parser.add_argument("--embeddings", choices=["openai", "local"], default=None,
+                        help="embedding backend (defaults to EMBEDDING_BACKEND or openai)")
+    args = parser.parse_args()
+    if args.embeddings:
+        os.environ["EMBEDDING_BACKEND"] = args.embeddings
+
     print("Loading PDF...")
-    raw_text = extract_text_from_pdf(PDF_PATH)
-    print("Splitting text...")
-    create_vector_store(raw_text)
\ No newline at end of file
+    pages = extract_pages(args.pdf, workers=args.workers)
+    print("Splitting and embedding text...")
+    create_vector_store(split_pages(pages), vector_path=args.out, full=args.full,
+                        index_type=args.index, quantization=args.quantization, report=args.report)
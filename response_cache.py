@@ -0,0 +1,168 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+
+import numpy as np
+from dotenv import load_dotenv
+
+from prompt_templates import PROMPT_VERSION
+from telemetry import record_cache
+
+load_dotenv()
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", os.path.join(BASE_DIR, ".cache", "responses.sqlite"))
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "1") != "0"
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "50000"))
+# Cosine similarity above which a previous answer's evaluation is reused.
+# Unset disables the near-duplicate tier (it costs an embedding lookup).
+_similarity = os.getenv("RESPONSE_CACHE_SIMILARITY")
+RESPONSE_CACHE_SIMILARITY = float(_similarity) if _similarity else None
+
+_PUNCT_RE = re.compile(r"[^\w\s]", re.UNICODE)
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_answer(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = _PUNCT_RE.sub(" ", text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+class ResponseCache:
+
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, ttl: float = RESPONSE_CACHE_TTL,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, similarity: float | None = RESPONSE_CACHE_SIMILARITY,
+                 embeddings=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self._embeddings = embeddings
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, scope TEXT NOT NULL, embedding BLOB, result TEXT NOT NULL, "
+            "created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_scope ON responses(scope)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)")
+        self._count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        self.counters = {"exact_hits": 0, "near_hits": 0, "misses": 0}
+
+    @staticmethod
+    def scope(lesson_key: str, model_choice: str, prompt_version: str = PROMPT_VERSION) -> str:
+        return f"{lesson_key}\x00{model_choice}\x00{prompt_version}"
+
+    @staticmethod
+    def key(answer: str, scope: str) -> str:
+        return hashlib.sha256(f"{scope}\x00{normalize_answer(answer)}".encode("utf-8")).hexdigest()
+
+    def _embed(self, answer: str) -> np.ndarray:
+        if self._embeddings is None:
+            from embedding_cache import get_embeddings
+
+            self._embeddings = get_embeddings()
+        vector = np.asarray(self._embeddings.embed_query(normalize_answer(answer)), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, answer: str, lesson_key: str, model_choice: str) -> dict | None:
+        scope = self.scope(lesson_key, model_choice)
+        key = self.key(answer, scope)
+        now = time.time()
+        cutoff = now - self.ttl
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM responses WHERE key = ? AND created >= ?", (key, cutoff)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+                self.counters["exact_hits"] += 1
+                record_cache("response", "exact_hit")
+                return json.loads(row[0])
+        if self.similarity is not None and normalize_answer(answer):
+            match = self._nearest(self._embed(answer), scope, cutoff)
+            if match is not None:
+                self.counters["near_hits"] += 1
+                record_cache("response", "near_hit")
+                return match
+        self.counters["misses"] += 1
+        record_cache("response", "miss")
+        return None
+
+    def _nearest(self, vector: np.ndarray, scope: str, cutoff: float) -> dict | None:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, embedding, result FROM responses "
+                "WHERE scope = ? AND created >= ? AND embedding IS NOT NULL", (scope, cutoff)
+            ).fetchall()
+        if not rows:
+            return None
+        matrix = np.frombuffer(b"".join(row[1] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+        if matrix.shape[1] != vector.shape[0]:
+            return None
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity:
+            return None
+        with self._lock:
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), rows[best][0]))
+        return json.loads(rows[best][2])
+
+    def put(self, answer: str, lesson_key: str, model_choice: str, result: dict):
+        scope = self.scope(lesson_key, model_choice)
+        key = self.key(answer, scope)
+        embedding = None
+        if self.similarity is not None and normalize_answer(answer):
+            embedding = self._embed(answer).tobytes()
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, scope, embedding, json.dumps(result, ensure_ascii=False), now, now),
+            )
+            self._count += 1
+            if self._count > self.max_entries:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        self._count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        excess = self._count - int(self.max_entries * 0.9)
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY last_used LIMIT ?)", (excess,)
+            )
+            self._count -= excess
+
+    def stats(self) -> dict:
+        lookups = sum(self.counters.values())
+        hits = self.counters["exact_hits"] + self.counters["near_hits"]
+        return {**self.counters, "entries": self._count, "hit_rate": hits / lookups if lookups else 0.0}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache | None:
+    global _cache
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
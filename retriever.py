@@ -0,0 +1,175 @@
+import os
+import time
+import hashlib
+import threading
+
+from dotenv import load_dotenv
+
+from embedding_cache import get_embeddings
+from hybrid_retriever import HybridRetriever, get_reranker
+from vector_index import load_store
+from telemetry import span
+
+load_dotenv()
+
+VECTOR_PATH = os.getenv("VECTOR_PATH", "./rag/vector_store")
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "1") != "0"
+# Hybrid ranking is precise enough that fewer chunks cover the lesson.
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "3" if HYBRID_RETRIEVAL else "4"))
+# Writers' temp files and SQLite sidecars come and go without the store
+# changing.
+_SIDECAR_SUFFIXES = ("-journal", "-wal", "-shm")
+
+
+def _is_sidecar(name: str) -> bool:
+    return name.startswith(".") or ".tmp" in name or name.endswith(_SIDECAR_SUFFIXES)
+
+
+class RetrieverService:
+    # Process-wide holder for the FAISS store. Loads once, is shared by every
+    # Streamlit session/thread and reloads when the files on disk change.
+
+    def __init__(self, vector_path: str = VECTOR_PATH, check_interval: float = 5.0, hybrid: bool = HYBRID_RETRIEVAL):
+        self.vector_path = vector_path
+        self.check_interval = check_interval
+        self.hybrid = hybrid
+        self._lock = threading.RLock()
+        self._db = None
+        self._hybrid = None
+        self._embeddings = None
+        self._fingerprint = None
+        self._mtimes = None
+        self._last_check = 0.0
+
+    def _files(self) -> list[str]:
+        if not os.path.isdir(self.vector_path):
+            return []
+        return sorted(
+            os.path.join(self.vector_path, name)
+            for name in os.listdir(self.vector_path)
+            if not _is_sidecar(name) and os.path.isfile(os.path.join(self.vector_path, name))
+        )
+
+    def _stat(self) -> tuple:
+        stats = []
+        for path in self._files():
+            # Listed, then removed before the stat: treat it as gone.
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            stats.append((path, stat.st_mtime_ns, stat.st_size))
+        return tuple(stats)
+
+    def _content_hash(self) -> str:
+        digest = hashlib.sha256()
+        for path in self._files():
+            try:
+                with open(path, "rb") as f:
+                    digest.update(os.path.basename(path).encode())
+                    for block in iter(lambda: f.read(1 << 20), b""):
+                        digest.update(block)
+            except FileNotFoundError:
+                continue
+        return digest.hexdigest()
+
+    def _get_embeddings(self):
+        if self._embeddings is None:
+            self._embeddings = get_embeddings()
+        return self._embeddings
+
+    def _load(self):
+        with span("retrieval.load_store"):
+            self._db = load_store(self.vector_path, self._get_embeddings())
+        self._hybrid = None
+        self._mtimes = self._stat()
+        self._fingerprint = self._content_hash()
+
+    def _reload_if_changed(self, now: float):
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        mtimes = self._stat()
+        if mtimes == self._mtimes:
+            return
+        # mtime moved; only reload when the bytes actually differ (e.g. a
+        # redeploy that touched the files without changing them).
+        fingerprint = self._content_hash()
+        self._mtimes = mtimes
+        if fingerprint != self._fingerprint:
+            print(f"Vector store at {self.vector_path} changed, reloading")
+            previous = self._db
+            try:
+                self._load()
+            except Exception as e:
+                # Half-written index during a deploy: keep serving the old one
+                # and try again on the next check.
+                print(f"Reload failed, keeping previous store: {e}")
+                self._db = previous
+                self._mtimes = None
+
+    def get_store(self):
+        with self._lock:
+            if self._db is None:
+                self._load()
+                self._last_check = time.monotonic()
+            else:
+                self._reload_if_changed(time.monotonic())
+            return self._db
+
+    def set_store(self, db):
+        # Pin an already-built store (benchmarks, offline runs); disables reload.
+        with self._lock:
+            self._db = db
+            self._hybrid = None
+            self._mtimes = self._stat()
+            self._fingerprint = "pinned"
+            self.check_interval = float("inf")
+
+    def warm_up(self, query: str = "الإعراب"):
+        # Load the index and open the embeddings client connection so the
+        # first student request after a deploy doesn't pay for it.
+        self.similarity_search(query, k=1)
+
+    def get_hybrid(self) -> HybridRetriever:
+        with self._lock:
+            db = self.get_store()
+            # The lexical index is built from the loaded docstore and rebuilt
+            # whenever the store is reloaded.
+            if self._hybrid is None or self._hybrid.db is not db:
+                self._hybrid = HybridRetriever(db, reranker=get_reranker())
+            return self._hybrid
+
+    def similarity_search(self, query: str, k: int = RETRIEVAL_K):
+        if self.hybrid:
+            hybrid = self.get_hybrid()
+            with span("retrieval.search", mode="hybrid"):
+                return hybrid.search(query, k=k)
+        db = self.get_store()
+        with span("retrieval.search", mode="dense"):
+            return db.similarity_search(query, k=k)
+
+    @property
+    def fingerprint(self) -> str | None:
+        return self._fingerprint
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_retriever(vector_path: str = VECTOR_PATH) -> RetrieverService:
+    global _service
+    with _service_lock:
+        if _service is None or _service.vector_path != vector_path:
+            _service = RetrieverService(vector_path)
+        return _service
+
+
+def warm_up():
+    get_retriever().warm_up()
+
+
+def retrieve_chunks(user_response, k=RETRIEVAL_K):
+    results = get_retriever().similarity_search(user_response, k=k)
+    return "\n---\n".join([doc.page_content for doc in results])
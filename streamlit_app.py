@@ -1,139 +1,148 @@
 import streamlit as st
 import requests
 import json
-from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
 import os
 from dotenv import load_dotenv
 from typing import List
-from prompt_templates import build_rag_prompt
-from evaluation_logger import append_example
-from model_switcher import evaluate, OutputFormat
 
 load_dotenv()
 
-VECTOR_PATH = "./rag/vector_store"
-
-def retrieve_chunks(user_response, k=4):
-    db = FAISS.load_local(
-        VECTOR_PATH, 
-        OpenAIEmbeddings(),
-        allow_dangerous_deserialization=True
-    )
-    results = db.similarity_search(user_response, k=k)
-    return "\n---\n".join([doc.page_content for doc in results])
-
-def evaluate_response_with_rag(user_response: str, lesson, model_choice: str) -> dict:
-    retrieved_text = retrieve_chunks(user_response)
-    key_points = lesson["key_points"]
-
-    prompt = build_rag_prompt(user_response, retrieved_text, key_points)
-    result = evaluate(prompt, model_choice)
-    append_example(prompt, result)
-    return result
-
-API_URL = "http://127.0.0.1:8000/evaluate"
-
-LESSONS = {
-    "lesson1": {
-        "title": "الإعراب",
-        "content": """
-            ### الإعراب
-            The Arabic cases are:
-            - الرفع
-                - Primarily used for the subject, predicate, and doer.
-            - النصب
-                - Primarily used for the done-to and after حروف which trigger it's use.
-            - الجر
-                - Primarily used after prepositions.
-
-            Cases in Arabic are applied through case markers at the end of words. They help signify what role a word plays in a sentence.
-        """,
-        "key_points": [
-            "الرفع is primarily used for the subject, predicate, and doer.",
-            "النصب is primarily used for the done-to and after حروف which trigger its use.",
-            "الجر is primarily used after prepositions."
-        ]
-    },
-        "lesson2": {
-        "title": "How to tell status",
-        "content": """
-            ### Determining Status
-            Status is generally determined by the ending sound or combination.
-            
-            - Singular words that end with a ضمة or ضمتان generally are الرفع.
-            - Singular words that end with a كسرة or كسرتان generally are الجر.
-            - Singular words that end with a فتحة or فتحتان generally are النصب. 
-        """,
-        "key_points": [
-            "Singular words that end with a ضمة or ضمتان generally are الرفع.",
-            "Singular words that end with a كسرة or كسرتان generally are الجر.",
-            "Singular words that end with a فتحة or فتحتان generally are النصب."         ]
-    },
-        "lesson3": {
-        "title": "Light vs. Heavy",
-        "content": """
-            ### Understanding Light and Heavy Words
-            Words can either be light or heavy, with heavy being the default.
-            In order to make a word light, simply remove the ن at the end.
-
-            For example:
-            - مسلمٌ <- مسلمُ
-            - مسلمان <- مسلما
-            - مسلمون <- مسلمو
-
-            - Words are never light unless there is a specific reason for them to be.
-        """,
-        "key_points": [
-            "Words are heavy by default",
-            "To make a word light, they ن must be removed."
-            "Words are never light unless there is a specific reason for them to be."
-        ]
-    },
-        "lesson4": {
-        "title": "Flexibility",
-        "content": """
-            ### Flexibility
-            Flexibility is a sub-category of status, and only pertains to words that have an ending sound (as opposed to ending combination).
-            - This means that flexibility only pertains to singular words.
-
-            There are three types of flexibility:
-            - Fully-flexible
-            - Partly-flexible
-            - Non-flexible
-        """,
-        "key_points": [
-                "Flexibility is a sub-category of status",
-                "Flexibility only pertains to singular words",
-                "Words may only be fully-flexible, partly-flexible, or non-flexible."
-        ]
-    },
-        "lesson5": {
-        "title": "Pronouns",
-        "content": """
-            ### Pronouns in Arabic
-            Arabic has 1st person, 2nd person, and 3rd person pronouns. The 1st person pronouns have the singular and plural form, and the 2nd/3rd person pronouns have singular, dual, and plural forms.   
-
-            Pronouns may take three forms:
-            - الضمير المستتر
-                - Pronouns within أفعال.
-            - الضمير المنفصل
-                - Pronouns independently standing by themselves.
-            - الضمير المتصل
-                - Attached pronouns.
-            """,
-        "key_points": [
-                "Arabic has 1st person, 2nd person, and 3rd person pronouns",
-                "The 1st person pronouns have singular and plural forms.",
-                "The 2nd/3rd person pronouns have singular, dual, and plural forms.",
-                "There are three forms that pronouns can take: الضمير المستتر, الضمير المنفصل, الضمير المتصل"
-        ]
-    }
-}
+# Base URL of api_server.py, e.g. http://127.0.0.1:8000. When set the app is a
+# thin client and loads no models or vector store; unset evaluates in-process.
+API_URL = os.getenv("EVAL_API_URL", "").rstrip("/")
+API_TIMEOUT = float(os.getenv("EVAL_API_TIMEOUT", "240"))
 
 st.set_page_config(page_title="Arabic Lesson Recall", layout="wide")
 st.title("Arabic Lesson Recall")
 
+
+def evaluate_remote(user_response: str, lesson, model_choice: str, lesson_id: str | None = None) -> dict:
+    response = requests.post(
+        f"{API_URL}/evaluate",
+        json={"answer": user_response, "lesson_id": lesson_id, "model": model_choice},
+        timeout=API_TIMEOUT,
+    )
+    if response.status_code != 200:
+        raise RuntimeError(response.json().get("detail", response.text))
+    return response.json()
+
+
+def evaluate_remote_stream(user_response: str, lesson, model_choice: str, lesson_id: str | None = None):
+    with requests.post(
+        f"{API_URL}/evaluate/stream",
+        json={"answer": user_response, "lesson_id": lesson_id, "model": model_choice},
+        timeout=API_TIMEOUT,
+        stream=True,
+    ) as response:
+        if response.status_code != 200:
+            raise RuntimeError(response.json().get("detail", response.text))
+        for line in response.iter_lines():
+            if not line:
+                continue
+            item = json.loads(line)
+            if "error" in item:
+                raise RuntimeError(item["error"])
+            yield item["result"], item["done"]
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def lesson_index_remote() -> list[tuple[str, str]]:
+    response = requests.get(f"{API_URL}/lessons", timeout=30)
+    response.raise_for_status()
+    return [(lesson["id"], lesson["title"]) for lesson in response.json()]
+
+
+@st.cache_data(ttl=60, max_entries=64, show_spinner=False)
+def load_lesson_remote(lesson_id: str) -> dict:
+    response = requests.get(f"{API_URL}/lessons/{lesson_id}", timeout=30)
+    response.raise_for_status()
+    return response.json()
+
+
+if API_URL:
+    evaluate_response_with_rag, evaluate_response_with_rag_stream = evaluate_remote, evaluate_remote_stream
+    lesson_index, load_lesson = lesson_index_remote, load_lesson_remote
+else:
+    from lesson_store import get_lesson_store
+    from retriever import warm_up
+    from telemetry import start_metrics_server
+    from evaluation_pipeline import evaluate_response_with_rag, evaluate_response_with_rag_stream
+
+    @st.cache_resource(show_spinner=False)
+    def _warm_retriever():
+        # Runs once per process; later reruns and sessions reuse the loaded store.
+        try:
+            warm_up()
+        except Exception as e:
+            print(f"Retriever warm-up failed: {e}")
+        start_metrics_server()
+        return True
+
+    _warm_retriever()
+
+    def lesson_index() -> list[tuple[str, str]]:
+        return get_lesson_store().index()
+
+    def load_lesson(lesson_id: str) -> dict:
+        return get_lesson_store().get(lesson_id)
+
+
+def render_points(title: str, points: list[str] | None, empty_text: str, done: bool):
+    with st.expander(title, expanded=not done and bool(points)):
+        if points:
+            for pt in points:
+                st.markdown(f"- {pt}")
+        elif done:
+            st.markdown(empty_text)
+        else:
+            st.markdown("_..._")
+
+
+def render_result(result: dict, slots: dict, done: bool):
+    # Called repeatedly while streaming: each section appears as soon as its
+    # field has fully arrived, list sections grow item by item.
+    if isinstance(result.get("score"), (int, float)):
+        score = result["score"]
+        if score >= 90:
+            level = "Excellent"
+            color = "green"
+        elif score >= 70:
+            level = "Good"
+            color = "blue"
+        else:
+            level = "Needs review"
+            color = "red"
+
+        with slots["score"].container():
+            st.success(f"Score: {score}/100")
+            st.markdown(
+                f"### Performance Level: <span style='color:{color}'>{level}</span>",
+                unsafe_allow_html=True,
+            )
+
+    # Feedback paragraph
+    if "generated_feedback" in result:
+        with slots["feedback"].container():
+            st.markdown("---")
+            st.markdown("### Feedback Summary")
+            st.success(result["generated_feedback"])
+
+    # Detailed analysis
+    if done or any(key in result for key in ("correct_points", "incorrect_points", "missed_points")):
+        with slots["details"].container():
+            st.markdown("---")
+            st.markdown("### Detailed Evaluation")
+            render_points("Correct Points", result.get("correct_points"), "_None detected._", done)
+            render_points("Incorrect Points", result.get("incorrect_points"), "_No misunderstandings identified._", done)
+            render_points("Missed Points", result.get("missed_points"), "_No major points were missed._", done)
+
+    # Rewrite
+    if "rewritten_answer" in result:
+        with slots["rewrite"].container():
+            st.markdown("---")
+            st.markdown("### Suggested Improved Answer")
+            st.info(result["rewritten_answer"])
+
 # Initialize recall flag
 if "show_recall" not in st.session_state:
     st.session_state.show_recall = False
@@ -144,13 +153,16 @@ if "hide_lesson" not in st.session_state:
 # Select
 model_choice = st.selectbox(
     "Choose evaluation model:",
-    options=["Gemini", "OpenAI"],
+    options=["Gemini", "OpenAI", "Race"],
+    format_func=lambda choice: "Fastest of Gemini/OpenAI" if choice == "Race" else choice,
     index=0
 )
 
 if not st.session_state.hide_lesson:
-    lesson_id = st.selectbox("Choose a lesson:", options=list(LESSONS.keys()), format_func=lambda k: LESSONS[k]["title"])
-    st.session_state.lesson = lesson = LESSONS[lesson_id]
+    titles = dict(lesson_index())
+    lesson_id = st.selectbox("Choose a lesson:", options=list(titles), format_func=lambda k: titles[k])
+    st.session_state.lesson_id = lesson_id
+    st.session_state.lesson = lesson = load_lesson(lesson_id)
     st.markdown(lesson["content"], unsafe_allow_html=True)
 
 print(st.session_state.lesson)
@@ -169,64 +181,22 @@ else:
         "Type everything you recall from this lesson", height=200
     )
 
+    stream_feedback = st.checkbox("Show feedback as it is written", value=True)
+
     if st.button("Evaluate Response"):
+        slots = {name: st.empty() for name in ("score", "feedback", "details", "rewrite")}
         with st.spinner("Evaluating..."):
             try:
-                result = evaluate_response_with_rag(user_input, st.session_state.lesson, model_choice)
-                print(result)
-            
-                # Score + Performance
-                score = result['score']
-                if score >= 90:
-                    level = "Excellent"
-                    color = "green"
-                elif score >= 70:
-                    level = "Good"
-                    color = "blue"
+                if stream_feedback:
+                    for result, done in evaluate_response_with_rag_stream(
+                        user_input, st.session_state.lesson, model_choice, lesson_id=st.session_state.get("lesson_id")
+                    ):
+                        render_result(result, slots, done)
                 else:
-                    level = "Needs review"
-                    color = "red"
-
-                st.success(f"Score: {score}/100")
-                st.markdown(
-                    f"### Performance Level: <span style='color:{color}'>{level}</span>",
-                    unsafe_allow_html=True,
-                )
-
-                # Feedback paragraph
-                st.markdown("---")
-                st.markdown("### Feedback Summary")
-                st.success(result["generated_feedback"])
-
-                # Detailed analysis
-                st.markdown("---")
-                st.markdown("### Detailed Evaluation")
-
-                with st.expander("Correct Points"):
-                    if result["correct_points"]:
-                        for pt in result["correct_points"]:
-                            st.markdown(f"- {pt}")
-                    else:
-                        st.markdown("_None detected._")
-
-                with st.expander("Incorrect Points"):
-                    if result["incorrect_points"]:
-                        for pt in result["incorrect_points"]:
-                            st.markdown(f"- {pt}")
-                    else:
-                        st.markdown("_No misunderstandings identified._")
-
-                with st.expander("Missed Points"):
-                    if result["missed_points"]:
-                        for pt in result["missed_points"]:
-                            st.markdown(f"- {pt}")
-                    else:
-                        st.markdown("_No major points were missed._")
-
-                # Rewrite
-                st.markdown("---")
-                st.markdown("### Suggested Improved Answer")
-                st.info(result["rewritten_answer"])
+                    result = evaluate_response_with_rag(
+                        user_input, st.session_state.lesson, model_choice, lesson_id=st.session_state.get("lesson_id")
+                    )
+                    render_result(result, slots, True)
 
             except Exception as e:
                 st.error(f"Error: {e}")
@@ -0,0 +1,216 @@
+import re
+import json
+
+from pydantic import BaseModel, ValidationError
+
+_FENCE_RE = re.compile(r"```(?:json)?", re.IGNORECASE)
+_NUMBER_RE = re.compile(r"-?(?:\d+)(?:\.\d+)?(?:[eE][+-]?\d+)?")
+_LITERALS = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", "/": "/", "\\": "\\", '"': '"', "'": "'"}
+
+# Field names models have been seen to produce instead of the schema's.
+FIELD_ALIASES = {"generate_feedback": "generated_feedback", "feedback": "generated_feedback"}
+
+
+class _Incomplete(Exception):
+    # Raised when the text ends mid-value; carries whatever part of the
+    # enclosing container was already complete.
+    def __init__(self, partial=None):
+        self.partial = partial
+
+
+class _TolerantParser:
+    # Accepts the JSON-ish text LLMs emit: code fences, prose around the
+    # object, trailing commas, single-quoted strings, Python literals and raw
+    # newlines inside strings. At end of input it returns the completed part.
+
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0
+
+    def _skip_ws(self):
+        while self.pos < len(self.text) and self.text[self.pos] in " \t\r\n":
+            self.pos += 1
+
+    def value(self):
+        self._skip_ws()
+        if self.pos >= len(self.text):
+            raise _Incomplete()
+        char = self.text[self.pos]
+        if char == "{":
+            return self._object()
+        if char == "[":
+            return self._array()
+        if char in "\"'":
+            return self._string()
+        if char == "-" or char.isdigit():
+            return self._number()
+        return self._literal()
+
+    def _object(self):
+        self.pos += 1
+        result = {}
+        while True:
+            self._skip_ws()
+            if self.pos >= len(self.text):
+                raise _Incomplete(result)
+            char = self.text[self.pos]
+            if char == "}":
+                self.pos += 1
+                return result
+            if char == ",":
+                self.pos += 1
+                continue
+            try:
+                key = self._string() if char in "\"'" else self._bare_key()
+                self._skip_ws()
+                if self.pos >= len(self.text):
+                    raise _Incomplete()
+                if self.text[self.pos] != ":":
+                    raise ValueError(f"Expected ':' at {self.pos}")
+                self.pos += 1
+                result[key] = self.value()
+            except _Incomplete as e:
+                if e.partial is not None:
+                    result[key] = e.partial
+                raise _Incomplete(result)
+
+    def _array(self):
+        self.pos += 1
+        result = []
+        while True:
+            self._skip_ws()
+            if self.pos >= len(self.text):
+                raise _Incomplete(result)
+            char = self.text[self.pos]
+            if char == "]":
+                self.pos += 1
+                return result
+            if char == ",":
+                self.pos += 1
+                continue
+            try:
+                result.append(self.value())
+            except _Incomplete:
+                # Only completed items are reported for a list still streaming.
+                raise _Incomplete(result)
+
+    def _string(self):
+        quote = self.text[self.pos]
+        self.pos += 1
+        parts = []
+        while True:
+            end = self.pos
+            while end < len(self.text) and self.text[end] not in (quote, "\\"):
+                end += 1
+            parts.append(self.text[self.pos:end])
+            if end >= len(self.text):
+                raise _Incomplete()
+            self.pos = end + 1
+            if self.text[end] == quote:
+                return "".join(parts)
+            if self.pos >= len(self.text):
+                raise _Incomplete()
+            escape = self.text[self.pos]
+            if escape == "u":
+                digits = self.text[self.pos + 1:self.pos + 5]
+                if len(digits) < 4:
+                    raise _Incomplete()
+                parts.append(chr(int(digits, 16)))
+                self.pos += 5
+            else:
+                parts.append(_ESCAPES.get(escape, escape))
+                self.pos += 1
+
+    def _number(self):
+        match = _NUMBER_RE.match(self.text, self.pos)
+        if not match:
+            raise ValueError(f"Bad number at {self.pos}")
+        self.pos = match.end()
+        # A number touching the end of the text may still be growing.
+        if self.pos >= len(self.text):
+            raise _Incomplete()
+        token = match.group()
+        return int(token) if token.lstrip("-").isdigit() else float(token)
+
+    def _bare_key(self):
+        start = self.pos
+        while self.pos < len(self.text) and (self.text[self.pos].isalnum() or self.text[self.pos] == "_"):
+            self.pos += 1
+        if self.pos >= len(self.text):
+            raise _Incomplete()
+        if start == self.pos:
+            raise ValueError(f"Expected key at {start}")
+        return self.text[start:self.pos]
+
+    def _literal(self):
+        for word, value in _LITERALS.items():
+            if self.text.startswith(word, self.pos):
+                self.pos += len(word)
+                return value
+            if word.startswith(self.text[self.pos:]):
+                raise _Incomplete()
+        raise ValueError(f"Unexpected character {self.text[self.pos]!r} at {self.pos}")
+
+
+def parse_partial(text: str) -> tuple[dict | None, bool]:
+    # Returns (object, complete). For a truncated or still-streaming object,
+    # `object` holds only the members whose values have fully arrived.
+    text = _FENCE_RE.sub("", text)
+    start = text.find("{")
+    if start == -1:
+        return None, False
+    parser = _TolerantParser(text)
+    parser.pos = start
+    try:
+        return parser.value(), True
+    except _Incomplete as e:
+        return e.partial, False
+    except ValueError:
+        return None, False
+
+
+def extract_json(text: str) -> dict | None:
+    stripped = _FENCE_RE.sub("", text).strip()
+    try:
+        data = json.loads(stripped)
+        if isinstance(data, dict):
+            return data
+    except json.JSONDecodeError:
+        pass
+    data, _ = parse_partial(text)
+    return data if isinstance(data, dict) else None
+
+
+def apply_aliases(data: dict) -> dict:
+    data = dict(data)
+    for alias, field in FIELD_ALIASES.items():
+        if alias in data and field not in data:
+            data[field] = data.pop(alias)
+    return data
+
+
+def check_output(data: dict | None, model: type[BaseModel]) -> tuple[dict | None, list[str]]:
+    # Returns (validated dict, []) or (None, names of missing/invalid fields).
+    if not isinstance(data, dict):
+        return None, list(model.model_fields)
+    try:
+        return model.model_validate(apply_aliases(data)).model_dump(), []
+    except ValidationError as e:
+        fields = []
+        for error in e.errors():
+            field = str(error["loc"][0]) if error["loc"] else None
+            if field in model.model_fields and field not in fields:
+                fields.append(field)
+        return None, fields or list(model.model_fields)
+
+
+def repair_prompt(fields: list[str], model: type[BaseModel]) -> str:
+    schema = model.model_json_schema()["properties"]
+    wanted = ",\n".join(f'    "{name}": <{schema[name].get("type", "value")}>' for name in fields)
+    return (
+        "Your previous reply could not be parsed: these fields were missing or malformed: "
+        f"{', '.join(fields)}.\n"
+        "Reply with ONLY a JSON object containing exactly these fields, nothing else:\n"
+        f"{{\n{wanted}\n}}"
+    )
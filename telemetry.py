@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TELEMETRY_ENABLED = os.getenv("TELEMETRY", "1") != "0"
+OTEL_TRACING = os.getenv("OTEL_TRACING", "0") == "1"
+METRICS_PREFIX = "recall_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Recent observations kept per series for the admin page's percentiles.
+RESERVOIR_SIZE = 2048
+# USD per million (input, output) tokens; override with LLM_PRICES='{"Gemini": [1.25, 10]}'.
+LLM_PRICES = {"Gemini": (1.25, 10.0), "OpenAI": (2.0, 8.0)}
+LLM_PRICES.update({provider: tuple(prices) for provider, prices in json.loads(os.getenv("LLM_PRICES", "{}")).items()})
+
+_tracer = None
+if TELEMETRY_ENABLED and OTEL_TRACING:
+    try:
+        from opentelemetry import trace
+
+        # Exporters are configured the standard OTel way (OTEL_EXPORTER_* env
+        # or `opentelemetry-instrument`); without an SDK the tracer is a no-op.
+        _tracer = trace.get_tracer("arabic-lesson-eval")
+    except ImportError:
+        print("OTEL_TRACING=1 but opentelemetry-api is not installed; spans are not exported")
+
+
+class _Histogram:
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, value: float):
+        index = 0
+        while index < len(LATENCY_BUCKETS) and value > LATENCY_BUCKETS[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = [*key, *extra]
+    if not pairs:
+        return ""
+    escaped = (
+        f'{name}="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class Registry:
+    # In-process counters and latency histograms, rendered in the Prometheus
+    # text format. Series are keyed by (metric name, sorted label pairs).
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.time()
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = _Histogram()
+            histogram.observe(value)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.started = time.time()
+
+    def render_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (list(h.buckets), h.count, h.sum)) for key, h in self.histograms.items())
+        typed = set()
+        for (name, labels), value in counters:
+            metric = f"{METRICS_PREFIX}{name}"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_format_labels(labels)} {value:g}")
+        for (name, labels), (buckets, count, total) in histograms:
+            metric = f"{METRICS_PREFIX}{name}"
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, bucket in zip((*LATENCY_BUCKETS, "+Inf"), buckets):
+                cumulative += bucket
+                le = bound if bound == "+Inf" else f"{bound:g}"
+                lines.append(f"{metric}_bucket{_format_labels(labels, (('le', le),))} {cumulative}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {count}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {total:.6f}")
+        return "\n".join(lines) + "\n"
+
+    def percentiles(self, name: str = "stage_duration_seconds") -> list[dict]:
+        with self._lock:
+            series = [(labels, h.count, list(h.recent)) for (metric, labels), h in self.histograms.items() if metric == name]
+        rows = []
+        for labels, count, recent in sorted(series):
+            ms = np.asarray(recent) * 1000
+            rows.append({
+                **dict(labels),
+                "count": count,
+                "p50_ms": round(float(np.percentile(ms, 50)), 2),
+                "p95_ms": round(float(np.percentile(ms, 95)), 2),
+                "p99_ms": round(float(np.percentile(ms, 99)), 2),
+                "max_ms": round(float(ms.max()), 2),
+            })
+        return rows
+
+    def counter_rows(self) -> list[dict]:
+        with self._lock:
+            counters = sorted(self.counters.items())
+        return [{"metric": name, **dict(labels), "value": value} for (name, labels), value in counters]
+
+
+registry = Registry()
+
+
+class _Span:
+    __slots__ = ("stage", "labels", "started", "_otel")
+
+    def __init__(self, stage: str, labels: dict):
+        self.stage = stage
+        self.labels = labels
+        self._otel = None
+
+    def __enter__(self):
+        if _tracer is not None:
+            self._otel = _tracer.start_as_current_span(self.stage, attributes=self.labels)
+            self._otel.__enter__()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        registry.observe("stage_duration_seconds", time.perf_counter() - self.started, stage=self.stage, **self.labels)
+        if exc_type is not None and not issubclass(exc_type, GeneratorExit):
+            registry.inc("errors_total", stage=self.stage, type=exc_type.__name__)
+        if self._otel is not None:
+            self._otel.__exit__(exc_type, exc, tb)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(stage: str, **labels):
+    # Times a pipeline stage into stage_duration_seconds{stage=...} and counts
+    # exceptions escaping it by type. A shared no-op when telemetry is off.
+    if not TELEMETRY_ENABLED:
+        return _NOOP
+    return _Span(stage, labels)
+
+
+def inc(name: str, value: float = 1.0, **labels):
+    if TELEMETRY_ENABLED:
+        registry.inc(name, value, **labels)
+
+
+def record_cache(cache: str, result: str, count: int = 1):
+    if TELEMETRY_ENABLED and count:
+        registry.inc("cache_requests_total", count, cache=cache, result=result)
+
+
+def record_tokens(provider: str, input_tokens: int, output_tokens: int):
+    if not TELEMETRY_ENABLED:
+        return
+    registry.inc("llm_requests_total", provider=provider)
+    registry.inc("llm_tokens_total", input_tokens, provider=provider, direction="input")
+    registry.inc("llm_tokens_total", output_tokens, provider=provider, direction="output")
+    input_price, output_price = LLM_PRICES.get(provider, (0.0, 0.0))
+    cost = (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+    if cost:
+        registry.inc("llm_cost_usd_total", cost, provider=provider)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int | None = None) -> int | None:
+    # Serves /metrics for Prometheus from processes without their own HTTP
+    # API (Streamlit). Port from METRICS_PORT; unset means don't serve.
+    global _server
+    port = port or int(os.getenv("METRICS_PORT", "0"))
+    if not port or not TELEMETRY_ENABLED:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            except OSError as e:
+                # Another Streamlit worker on this host already serves it.
+                print(f"Metrics server not started on port {port}: {e}")
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _server.server_address[1]
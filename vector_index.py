@@ -0,0 +1,283 @@
+import os
+import json
+import math
+import time
+import uuid
+import shutil
+import sqlite3
+import tempfile
+import threading
+from collections.abc import Mapping
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+INDEX_NAME = "index.faiss"
+DOCSTORE_NAME = "docstore.sqlite"
+# Each build gets its own directory under versions/; CURRENT names the live
+# one, so index and docstore switch together with a single rename.
+VERSIONS_DIR = "versions"
+STORE_POINTER = "CURRENT"
+# Older versions stay on disk a while: a process still serving one opens
+# docstore connections lazily, per thread, until it notices the switch.
+KEEP_VERSIONS = 3
+INDEX_TYPES = ("flat", "ivf", "hnsw")
+QUANTIZATIONS = ("none", "sq8", "pq")
+# Lets SQLite map the docstore into memory: pages are shared by every worker
+# process through the OS page cache instead of copied into each heap.
+DOCSTORE_MMAP_BYTES = 1 << 30
+
+
+class SQLiteDocstore:
+    # Non-pickle docstore for the LangChain FAISS wrapper. Row `position`
+    # is the vector's position in the FAISS index.
+
+    def __init__(self, path: str, read_only: bool = True):
+        self.path = path
+        self.read_only = read_only
+        self._local = threading.local()
+        if not read_only:
+            conn = self._conn()
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "position INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, page_content TEXT NOT NULL, metadata TEXT NOT NULL)"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.read_only:
+                conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            else:
+                conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute(f"PRAGMA mmap_size={DOCSTORE_MMAP_BYTES}")
+            self._local.conn = conn
+        return conn
+
+    def add_documents(self, start: int, ids: list[str], documents: list[Document]):
+        rows = [
+            (start + offset, doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False))
+            for offset, (doc_id, doc) in enumerate(zip(ids, documents))
+        ]
+        with self._conn() as conn:
+            conn.executemany("INSERT INTO documents VALUES (?, ?, ?, ?)", rows)
+
+    def search(self, search: str) -> Document | str:
+        row = self._conn().execute(
+            "SELECT page_content, metadata FROM documents WHERE id = ?", (search,)
+        ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def iter_documents(self):
+        for page_content, metadata in self._conn().execute(
+            "SELECT page_content, metadata FROM documents ORDER BY position"
+        ):
+            yield Document(page_content=page_content, metadata=json.loads(metadata))
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def delete(self, ids: list):
+        raise ValueError("SQLiteDocstore is read-only; rebuild the store with rag/ingest_pdf.py")
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+
+class SQLiteIndexMapping(Mapping):
+    # index position -> docstore id, read from the docstore on demand instead
+    # of held as a dict of every id.
+
+    def __init__(self, docstore: SQLiteDocstore):
+        self.docstore = docstore
+
+    def __getitem__(self, position: int) -> str:
+        row = self.docstore._conn().execute(
+            "SELECT id FROM documents WHERE position = ?", (int(position),)
+        ).fetchone()
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def __iter__(self):
+        for (position,) in self.docstore._conn().execute("SELECT position FROM documents ORDER BY position"):
+            yield position
+
+    def __len__(self) -> int:
+        return len(self.docstore)
+
+    def values(self):
+        return [doc_id for (doc_id,) in self.docstore._conn().execute("SELECT id FROM documents ORDER BY position")]
+
+
+def _pq_subquantizers(dim: int) -> int:
+    # ~16 dimensions per sub-quantizer, and it must divide the dimension.
+    m = max(1, dim // 16)
+    while dim % m:
+        m -= 1
+    return m
+
+
+def factory_string(index_type: str, quantization: str, count: int, dim: int) -> str:
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES}")
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization {quantization!r}, expected one of {QUANTIZATIONS}")
+    # 8-bit PQ codebooks need ~10k training vectors; small books use 4 bits.
+    if quantization == "pq" and count < 16:
+        raise ValueError(f"PQ needs at least 16 vectors to train, got {count}")
+    pq = f"PQ{_pq_subquantizers(dim)}" + ("" if count >= 256 * 39 else "x4")
+    codec = {"none": "Flat", "sq8": "SQ8", "pq": pq}[quantization]
+    if index_type == "flat":
+        return codec
+    if index_type == "ivf":
+        nlist = max(1, min(int(4 * math.sqrt(count)), count // 39 or 1))
+        return f"IVF{nlist},{codec}"
+    return "HNSW32" if quantization == "none" else f"HNSW32,{codec}"
+
+
+def build_index(vectors: np.ndarray, index_type: str = "flat", quantization: str = "none",
+                nprobe: int = 8, ef_search: int = 64):
+    count, dim = vectors.shape
+    index = faiss.index_factory(dim, factory_string(index_type, quantization, count, dim))
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    # Search-time knobs are stored with the index, so the app needs no config.
+    if index_type == "ivf":
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    elif index_type == "hnsw":
+        faiss.downcast_index(index).hnsw.efSearch = ef_search
+    return index
+
+
+def recall_report(vectors: np.ndarray, options: list[tuple[str, str]], k: int = 10, sample: int = 200,
+                  seed: int = 0) -> list[dict]:
+    # Recall@k of each index option against exact search, using a sample of
+    # the corpus vectors themselves as queries.
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), size=min(sample, len(vectors)), replace=False)]
+    k = min(k, len(vectors))
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    rows = []
+    for index_type, quantization in options:
+        started = time.perf_counter()
+        try:
+            index = build_index(vectors, index_type, quantization)
+        except (ValueError, RuntimeError) as e:
+            print(f"Skipping {index_type}/{quantization}: {e}")
+            continue
+        build_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        _, found = index.search(queries, k)
+        search_ms = (time.perf_counter() - started) * 1000 / len(queries)
+        recall = float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, INDEX_NAME)
+            faiss.write_index(index, path)
+            size = os.path.getsize(path)
+        rows.append({
+            "index": index_type,
+            "quantization": quantization,
+            f"recall@{k}": round(recall, 4),
+            "ms_per_query": round(search_ms, 4),
+            "build_seconds": round(build_seconds, 2),
+            "bytes": size,
+        })
+    return rows
+
+
+def format_report(rows: list[dict]) -> str:
+    if not rows:
+        return ""
+    columns = list(rows[0])
+    widths = [max(len(column), *(len(str(row[column])) for row in rows)) for column in columns]
+    lines = ["  ".join(column.ljust(width) for column, width in zip(columns, widths))]
+    for row in rows:
+        lines.append("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+    return "\n".join(lines)
+
+
+def new_store_version(vector_path: str) -> str:
+    name = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    path = os.path.join(vector_path, VERSIONS_DIR, name)
+    os.makedirs(path)
+    return path
+
+
+def current_store_dir(vector_path: str) -> str | None:
+    # Directory holding the live index.faiss/docstore.sqlite pair, or None
+    # for a legacy pickle store.
+    try:
+        with open(os.path.join(vector_path, STORE_POINTER), encoding="utf-8") as f:
+            return os.path.join(vector_path, VERSIONS_DIR, f.read().strip())
+    except FileNotFoundError:
+        pass
+    # Stores built before versioned directories keep the pair at the top.
+    if os.path.exists(os.path.join(vector_path, DOCSTORE_NAME)):
+        return vector_path
+    return None
+
+
+def _prune_versions(vector_path: str, current: str):
+    versions_path = os.path.join(vector_path, VERSIONS_DIR)
+    names = sorted(os.listdir(versions_path), reverse=True)
+    keep = {current, *[name for name in names if name != current][:KEEP_VERSIONS - 1]}
+    for name in names:
+        if name not in keep:
+            shutil.rmtree(os.path.join(versions_path, name), ignore_errors=True)
+
+
+def save_store(vector_path: str, index, version_dir: str):
+    # version_dir comes from new_store_version and already holds the
+    # docstore. Nothing a reader can see changes until CURRENT is replaced.
+    faiss.write_index(index, os.path.join(version_dir, INDEX_NAME))
+    name = os.path.basename(version_dir)
+    tmp_pointer = os.path.join(vector_path, f"{STORE_POINTER}.tmp")
+    with open(tmp_pointer, "w", encoding="utf-8") as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_pointer, os.path.join(vector_path, STORE_POINTER))
+    _prune_versions(vector_path, name)
+    # A legacy index.pkl is left alone; load_store ignores it once CURRENT
+    # exists.
+
+
+def load_vectors(store_dir: str) -> tuple[list[str], np.ndarray]:
+    # (docstore ids, vectors) in index order, read back from an uncompressed
+    # index; SQ8/PQ indexes only hold approximations, so callers check first.
+    index = faiss.read_index(os.path.join(store_dir, INDEX_NAME))
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    docstore = SQLiteDocstore(os.path.join(store_dir, DOCSTORE_NAME))
+    try:
+        ids = SQLiteIndexMapping(docstore).values()
+    finally:
+        docstore.close()
+    return ids, index.reconstruct_n(0, index.ntotal)
+
+
+def load_store(vector_path: str, embeddings) -> FAISS:
+    store_dir = current_store_dir(vector_path)
+    if store_dir is None:
+        # Stores built before the SQLite docstore still use LangChain's pickle.
+        return FAISS.load_local(vector_path, embeddings, allow_dangerous_deserialization=True)
+    index_path = os.path.join(store_dir, INDEX_NAME)
+    try:
+        index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        index = faiss.read_index(index_path)
+    docstore = SQLiteDocstore(os.path.join(store_dir, DOCSTORE_NAME))
+    return FAISS(embeddings, index, docstore, SQLiteIndexMapping(docstore))